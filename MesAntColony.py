@@ -1,20 +1,21 @@
 from mesa import Agent, Model
-from mesa.time import RandomActivation
+from mesa.time import BaseScheduler
 from mesa.space import NetworkGrid
-from mesa.datacollection import DataCollector
-from networkx.classes.function import get_node_attributes, set_node_attributes, set_edge_attributes, get_edge_attributes
 
-import time, enum, math
+import time, enum
+from collections import namedtuple
 import numpy as np
-import pandas as pd
-import pylab as plt
 
 import networkx as nx
-from networkx.drawing.nx_agraph import write_dot, graphviz_layout, read_dot
-import matplotlib.pyplot as plt
-import matplotlib.colors as clr
-import itertools
-import random
+from occupancy import OccupancyCollector, occupancy_timeseries, count_dtype
+from seeding import ModelRandom
+from instrument import Probe, NULL_PROBE
+import checkpoint
+import result_cache
+from tree_build import balanced_tree, tree_edges, tile, FOODDIST
+from layout import tree_layout, tip_positions, clockwise_labels, LAB_LABELS
+from frames import render
+from tree_state import TreeState, TurnTable, NTYPES, choose, leave_chance, arrive_table
 
 
 ##################################
@@ -28,6 +29,7 @@ parameters = {
 
     'padd' : 0.1, # the amount of pheromone added by an ant in 1 time step
     'pdecay' : -0.01, # the amount of pheromone decayed every time step on the entire tree
+    'pdecay_rate' : 0, # the fraction of pheromone decayed every time step on the entire tree (the notebook's multiplicative decay)
 
     'leave_home' : 0.10 # the probability for an ant to leave their home
 }
@@ -38,91 +40,42 @@ parameters = {
 #       Tree Construction        #
 ##################################
 
-def balanced_tree(depth=5, weight_map = [0.338,0.253,0.253,0.253,0.338,0.45,0.253,0.338,0.338,0.45,0.6,0.45,0.338,0.45,0.253,0.338,0.338,0.45,0.253,0.338,0.253,0.338,0.253,0.253,0.45,0.6,0.338,0.45,0.338,0.45,0.338,0.253]):
+def construct_tree(leaves=None, fooddist=None):
     """
-    Inputs: a 'depth' of the tree and a map of the weights of the leaves. Weights proceed from left most tip and then clock-wise around the tree.
-    Output: a dictionary of leaf names with LR nomenclature and corresponding weights
+    Input: a Dictionary of leaf names and branch widths leading to the leaves (balanced_tree() when omitted). Leaves are named with the convention 'LRLLRL', dictating how to get to the leaf. Also fooddist, a list of the tip types traveling clockwise (FOODDIST repeated around the tree when omitted).
+    Outputs: a tree constructed in networkx following the tree building rules, built in linear time by tree_edges.
+    Every node also gets an integer 'id', its position in G.nodes() (and in TreeState.names), so names and ids map both ways.
     """
-    leaf_names = []
-    uniques = list(''.join(tup) for tup in itertools.product('LR', repeat = depth))
-    weight_map.reverse()
-    for i in range(2**depth):
-        leaf_names += ['O'+ uniques[i]]
-
-    leafd = {}
-    i=0
-    for leaf in leaf_names:
-        leafd[leaf] = weight_map[i]
-        i+=1
-
-
-    return leafd
-
-def construct_tree(leaves=balanced_tree(), fooddist=['Food','Food','Nest','Node','Food','Food','Node','Nest','Node','Nest','Food','Food','Food','Food','Nest','Node','Node','Nest','Food','Food','Node','Nest','Food','Food','Nest','Node','Food','Food','Node','Nest','Food','Food']):
-    """
-    Input: a Dictionary of leaf names and branch widths leading to the leaves. Leaves are named with the convention 'LRLLRL', dictating how to get to the leaf. Also fooddist, a list of the tip types traveling clockwise.
-    Outputs: a tree constructed in networkx following the tree building rules.
-    """
-    leafd = leaves
+    names, edges = tree_edges(balanced_tree() if leaves is None else leaves)
+    tips = len(names) - len(edges)//2
+    if fooddist is None:
+        fooddist = tile(FOODDIST, tips)
+    if len(fooddist) < tips:
+        raise ValueError(f'fooddist has {len(fooddist)} tip types for {tips} tips')
+    ntypes = list(fooddist[:tips]) + ['Node'] * (len(names) - tips) # Set leaves as a Food, Nest, or a Node, other nodes are normal
+    ntypes[names.index('O')] = 'Home' # Set start node as home
     G = nx.Graph()
-    i = 0 
-    for leaf in leafd:
-        G.add_node(leaf, ntype = fooddist[i], ants=0) # Set leaves as a Food, Nest, or a Node
-        i+=1
-
-    while not 'O' in leafd:
-
-        leaf = list(leafd.keys())[0]
-
-        for leaf2 in leafd:
-            if leaf2 != leaf and len(leaf2) == len(leaf):
-                if leaf2[:len(leaf2)-1] == leaf[:len(leaf)-1]:
-                    junc = leaf[:len(leaf)-1] # The junction between two nodes is their name with the last letter cut off
-                    if junc == 'O':
-                        G.add_node(junc, ntype = "Home", ants=0) # Set start node as home
-                    else:
-                        G.add_node(junc, ntype = "Node", ants=0) # Other nodes are normal
-
-                    G.add_edge(junc, leaf2, weight = leafd[leaf2], p = 0)
-                    G.add_edge(junc, leaf, weight = leafd[leaf], p = 0)
-                    
-                    
-                    leafd[junc] = (leafd[leaf] if leafd[leaf] > leafd[leaf2] else leafd[leaf2])
-                    del leafd[leaf]
-                    del leafd[leaf2]
-                    break
+    G.add_nodes_from((name, {'ntype' : ntype, 'ants' : 0, 'id' : i}) for i, (name, ntype) in enumerate(zip(names, ntypes)))
+    G.add_edges_from((junc, leaf, {'weight' : weight, 'p' : 0}) for junc, leaf, weight in edges)
     return G
     
-def graph_draw(G,data, labels_ordered = True):
+def node_colors(G):
     """
-    Inputs: G, a tree in networkx and data from the Mesa model. Data is in the form of dictionary with time steps. Gross conversions proceed. Labels_ordered dictacts what naming scheme to use (True = clockwise, False = lab).
-    Output: draws a networkx plot and an area plot from a pandas dataframe
+    The colors graph_draw gives the nodes of G, in G.nodes() order: nests are colored by their clockwise group of four tips (tip_positions), the groups spread
+    evenly over eight tab colors (one color per letter A-H on the default tree), red for home, faded green for food and faded blue otherwise.
     """
-    datan = list(G.nodes(data=True))
-    nodes = G.nodes()
-    node_size_map = []
-    i = 0
-    for node in G:
-        node_size_map+=[datan[i][1]['ants'] *10 + 20]
-        i+=1
-    
-    G = nx.relabel_nodes(G, lambda name: (int(name.replace('L','0').replace('R','1')[1:],2)+1) if len(name) == 6 else name)
-    G = nx.relabel_nodes(G, lambda name: (chr(((name-1)//4) + 65) + str((name-1)%4) if isinstance(name,int) else name)) # Changes node labels from LR to clockwise
-    pos = graphviz_layout(G, prog = 'twopi') #prog = 'dot' for other view
-    plt.title(str(parameters))
-    
-    
+    import matplotlib.colors as clr
+    positions, slots = tip_positions(G)
+    groups = max(1, slots // 4)
     colors = ['tab:blue', 'tab:orange', 'tab:cyan','tab:red', 'tab:purple', 'tab:brown', 'tab:pink', 'tab:olive']
     color_map = []
-    datan = list(G.nodes(data=True))
-    i = 0
-    for node in G:
-        if datan[i][1]['ntype'] == 'Nest':
-            color = clr.to_rgba(colors[ord(node[0])-65])
+    for name, ntype in G.nodes(data='ntype'):
+        if ntype == 'Nest':
+            color = clr.to_rgba(colors[(positions.get(name, 0)//4) * len(colors) // groups])
             color_map.append(color)
-        elif datan[i][1]['ntype'] == "Home":
+        elif ntype == "Home":
             color_map.append(clr.to_rgba('red')) 
-        elif datan[i][1]['ntype'] == "Food":
+        elif ntype == "Food":
             color = clr.to_rgba('green')
             color = (color[0],color[1],color[2], color[3] - 0.5)
             color_map.append(color) 
@@ -130,8 +83,32 @@ def graph_draw(G,data, labels_ordered = True):
             color = clr.to_rgba('blue')
             color = (color[0],color[1],color[2], color[3] - 0.5)
             color_map.append(color) 
-        i+=1
+    return color_map
 
+def graph_draw(G,data, labels_ordered = True):
+    """
+    Inputs: G, a tree in networkx and data from the Mesa model. Data is in the form of dictionary with time steps. Gross conversions proceed. Labels_ordered dictacts what naming scheme to use (True = clockwise, False = lab).
+    Output: draws a networkx plot and an area plot from a pandas dataframe
+    """
+    import matplotlib.pyplot as plt # plotting is only loaded to draw, so sim() runs without matplotlib
+    import matplotlib.colors as clr
+    if 'state' in G.graph: # write back the attributes of a model that is still running
+        G.graph['state'].sync(G)
+    datan = list(G.nodes(data=True))
+    nodes = G.nodes()
+    node_size_map = []
+    i = 0
+    for node in G:
+        node_size_map+=[datan[i][1]['ants'] *10 + 20]
+        i+=1
+    
+    clockwise = clockwise_labels(G) # computed once per tree topology, like the layout
+    color_map = node_colors(G)
+    pos = tree_layout(G)
+    G = nx.relabel_nodes(G, clockwise) # Changes node labels from LR to clockwise
+    pos = {clockwise.get(node, node): xy for node, xy in pos.items()}
+    plt.title(str(G.graph.get('parameters', parameters)))
+    
     
     color_map_edge = []
 
@@ -148,9 +125,8 @@ def graph_draw(G,data, labels_ordered = True):
         
 
     if not labels_ordered:
-        d = {"C0":'1111',"C1":'1112',"C2":'1121',"C3":'1122','D0':'1211','D1':'1212','D2':'1221','D3':'1222','G0':'2111','G1':'2112','G2':'2121','G3':'2122','H0':'2211','H1':'2212','H2':'2221','H3':'2222','A0':'311','A1':'312','A2':'321','A3':'322','E0':'411','E1':'412','E2':'421','E3':'422','B0':'51','B1':'52','F2':'61','F3':'62','B2':'71','B3':'72','F0':'81','F1':'82'}
-        G = nx.relabel_nodes(G, d)
-        pos = graphviz_layout(G, prog = 'twopi')
+        G = nx.relabel_nodes(G, LAB_LABELS)
+        pos = {LAB_LABELS.get(node, node): xy for node, xy in pos.items()}
 
 
     name_map = {}
@@ -163,33 +139,18 @@ def graph_draw(G,data, labels_ordered = True):
     nx.draw_networkx_labels(G,pos,name_map,font_size=16,font_color='black')
     plt.gca().invert_xaxis()
    
-    # Creating the area plot
-    datadict = {}
-    datadictlist = [datadict]
-    for i in range(int(len(data['Position'])/len(data['Position'][0]))):
-        
-        for k in range(len(data['Position'][i])):
-            if not data['Position'][i][k] in datadict:
-                datadict[data['Position'][i][k]] = 1
-            else:
-                datadict[data['Position'][i][k]] += 1
+    # Creating the area plot, home node first
+    order = ['O'] + [node for node in nodes if node != 'O']
+    colors_by_node = dict(zip(nodes, color_map))
+    occupancy = occupancy_timeseries(data, order)
 
-        for node in nodes:
-            if not node in datadict:
-                datadict[node] = 0
-            
-
-        datadictlist+=[datadict]
-        datadict = {}
-    datadictlist = datadictlist[1:]
-
-    ax = pd.DataFrame(datadictlist).plot.area(colormap=clr.ListedColormap([color_map[-1]]+color_map[:-1]))
+    ax = occupancy.plot.area(colormap=clr.ListedColormap([colors_by_node[node] for node in order]))
     
     ax.set_ylabel('ants')
     ax.set_xlabel('time')
 
     ax.get_legend().remove()
-    plt.title(str(parameters))
+    plt.title(str(G.graph.get('parameters', parameters)))
     
     plt.show()
 
@@ -204,142 +165,88 @@ class States(enum.Enum):
     SEARCHING = 2
     RETURNING = 3
 
+# The state an ant takes on when it steps onto each node type (AgAnt.update), as arrive_table reads it
+ARRIVE = {'Nest' : States.WAITING_NEST.value, 'Food' : States.RETURNING.value, 'Home' : States.WAITING_HOME.value}
+
 class AgAnt(Agent):
     """
     The AgAnt class is a custom agent class in mesa, with unique ids and created in a specified model. They store information about their position (node O to start) and previous positions.
     They make decisions about where to move based on their previous position, current poisiont, and biases. Agents do not interact in this model.
+    Alongside the node names used by the grid, ants keep the integer id of their node so they read and write the model's TreeState directly.
     """
     def __init__(self,unique_id,model):
         super().__init__(unique_id,model)
         self.pos = 'O'
         self.ppos = None
+        self.node = model.state.index['O']
+        self.approach = model.state.start('O') # (ppos, pos) as one TreeState approach id
         self.state = States.WAITING_HOME
 
 
-    def choice(self,neighbors):
+    def choice(self):
         """
-        Inputs: self, list of neighbors.
-        Outputs: A choice of neighbor to move to next based on the options availible, biases, and pheromone precense.
+        Inputs: self.
+        Outputs: the approach (current node -> next node) the ant takes, drawn with one uniform draw from the model's TurnTable, which holds the width, left/right, u-turn and pheromone weighted probabilities for every (previous node, current node).
         """
-        if len(neighbors) == 1:
-                return neighbors[0]
-        else:
-            for i in range(len(neighbors)):
-                neighbors[i] = [neighbors[i] , self.model.G.get_edge_data(self.pos, neighbors[i])]
-
-            if len(neighbors) == 2:
-                probs = [neighbors[0][1]['weight']**parameters['width'] + neighbors[0][1]['p'] , neighbors[1][1]['weight']**parameters['width'] + neighbors[1][1]['p']]
-
-            
-                
-                for i in range(len(probs)):
-                    if neighbors[i][0][-1] == 'L':
-                        probs[i] *= parameters['left']
-                    elif neighbors[i][0][-1] == 'R':   
-                        probs[i] *= parameters['right']
-                    else:
-                        probs[i] *= parameters['u-turn']
-
-                total = probs[0]+probs[1]
-                probs[0] = probs[0]/total
-                probs[1] = probs[1]/total
-            
-                r = random.random()
-                if r < probs[0]:
-                    return neighbors[0][0]
-                else:
-                    return neighbors[1][0]
-
-            else: 
-
-                probs = [neighbors[0][1]['weight']**parameters['width'] + neighbors[0][1]['p'],neighbors[1][1]['weight']**parameters['width'] + neighbors[1][1]['p'],neighbors[2][1]['weight']**parameters['width'] + neighbors[2][1]['p']]
-                
-                if len(self.ppos) < len(self.pos): #if facing 'forwards'
-                    for i in range(len(probs)):
-                        
-                        if neighbors[i][0] == self.ppos:
-                            probs[i] *= parameters['u-turn']
-                        elif neighbors[i][0][-1] == 'L':
-                            probs[i] *= parameters['left']
-                        elif neighbors[i][0][-1] == 'R':
-                            probs[i] *= parameters['right']
-                else: #if facing 'backwards'
-                    for i in range(len(probs)):
-                        
-                        if neighbors[i][0] == self.ppos:
-                            probs[i] *= parameters['u-turn']
-                        elif neighbors[i][0][-1] == 'L':
-                            probs[i] *= parameters['right']
-                        elif neighbors[i][0][-1] == 'R':
-                            probs[i] *= parameters['left']
-                        
-                total = probs[0]+probs[1]+probs[2]
-                probs[0] = probs[0]/total
-                probs[1] = probs[1]/total
-                probs[2] = probs[2]/total
-
-                r = random.random()
-                if r < probs[0]:
-                    return neighbors[0][0]
-                elif r < probs[0]+probs[1]:
-                    return neighbors[1][0]
-                else:
-                    return neighbors[2][0]
+        return int(self.model.turns.sample(self.approach, self.model.random.random()))
 
     def move(self):
         """
         Moves the ant if their state is returning or searching. If returning, leaves pheromone.
         """
-        if self.state == States.RETURNING:
-            neighbors = list(self.model.G.neighbors(self.pos))
-                
-            node = self.choice(neighbors)
-
-            ants = {self.pos : {'ants' : get_node_attributes(self.model.G, 'ants')[self.pos] - 1}, node : { 'ants' : get_node_attributes(self.model.G, 'ants')[node] + 1}}
-            p = {(self.pos,node) : {'p' : self.model.G.get_edge_data(self.pos,node)['p'] + parameters['padd']}}
+        tree = self.model.state
+        if self.state == States.RETURNING or self.state == States.SEARCHING:
+            previous = self.approach
+            self.approach = self.choice()
+
+            if self.state == States.RETURNING:
+                edge = tree.edge[self.approach]
+                tree.settle(edge)
+                tree.p[edge] += self.model.params['padd']
+                self.model.turns.patch(edge)
+
+            to = int(tree.approach_node[self.approach])
+            tree.move(self.node, to)
+            self.node = to
             self.ppos = self.pos
-            self.model.grid.move_agent(self, node)
-            set_node_attributes(self.model.G, ants)
-            set_edge_attributes(self.model.G, p)
+            self.pos = tree.names[to] # the grid catches up at sync(), a move here would cost a list.remove per ant
 
-        elif self.state == States.SEARCHING:
-            neighbors = list(self.model.G.neighbors(self.pos))
-            
-            node = self.choice(neighbors)
-
-            ants = {self.pos : {'ants' : get_node_attributes(self.model.G, 'ants')[self.pos] - 1}, node : { 'ants' : get_node_attributes(self.model.G, 'ants')[node] + 1}}
-            self.ppos = self.pos
-            self.model.grid.move_agent(self, node)
-            set_node_attributes(self.model.G, ants)
+            probe = self.model.probe
+            if probe.enabled:
+                probe.count('moves')
+                probe.count('uturns', int(to == tree.approach_prev[previous]))
+                probe.count('deposits', int(self.state == States.RETURNING))
 
     def update(self):
         """
         Updates the ant's state based on their position in the tree.
         """
-        if get_node_attributes(self.model.G, 'ntype')[self.pos] == 'Nest':
+        before = self.state
+        ntype = NTYPES[self.model.state.ntype[self.node]]
+        if ntype == 'Nest':
             self.state = States.WAITING_NEST
-        elif get_node_attributes(self.model.G, 'ntype')[self.pos] == 'Food':
+        elif ntype == 'Food':
             self.state = States.RETURNING
-        elif get_node_attributes(self.model.G, 'ntype')[self.pos] == 'Home':
+        elif ntype == 'Home':
             self.state = States.WAITING_HOME
+        if self.state != before:
+            self.model.probe.count('transitions')
 
     def step(self):
         """
         Changes states based on random chance, then calls self.move to move the ant (if applicable), then calls self.update to update their state if they moved into a new type of node.
         """
         if self.state == States.WAITING_HOME:
-            if random.random() < parameters['leave_home']:
+            if self.model.random.random() < self.model.params['leave_home']:
                 self.state = States.SEARCHING
+                self.model.probe.count('transitions')
                 self.move()
 
         elif self.state == States.WAITING_NEST:
-            p0 = parameters['leave_home']
-            r = 0.2
-            a = 10
-            x = get_node_attributes(self.model.G, 'ants')[self.pos]
-            chance = -((1-p0)/(1 + math.exp(-r*(x-a)))) + 1
-            if random.random() < chance:
+            chance = leave_chance(self.model.state.ants[self.node], self.model.params['leave_home'])
+            if self.model.random.random() < chance:
                 self.state = States.RETURNING
+                self.model.probe.count('transitions')
                 self.move()
 
         elif self.state == States.SEARCHING: 
@@ -351,64 +258,510 @@ class AgAnt(Agent):
         self.update()
    
 
+class ActiveActivation(BaseScheduler):
+    """
+    ActiveActivation is a scheduler for the colony model that keeps ants bucketed by state and node. Waiting ants are never activated one by one: each step the departures
+    from every node are drawn in bulk, binomial with 'leave_home' at home and with the logistic chance of the node's count at a nest, and the leavers picked uniformly among the ants waiting there.
+    Only travelling ants (searching or returning, plus this step's leavers) are activated individually, in random order, so a step costs in proportion to the traffic instead of the population.
+    """
+    def __init__(self, model):
+        super().__init__(model)
+        self.moving = {} # unique_id -> travelling ant
+        self.waiting = {} # node id -> ants waiting there
+
+    def add(self, agent):
+        super().add(agent)
+        self._file(agent)
+
+    def remove(self, agent):
+        super().remove(agent)
+        if agent.unique_id in self.moving:
+            del self.moving[agent.unique_id]
+        else:
+            self.waiting[agent.node].remove(agent)
+
+    def _file(self, agent):
+        if agent.state == States.SEARCHING or agent.state == States.RETURNING:
+            self.moving[agent.unique_id] = agent
+        else:
+            self.waiting.setdefault(agent.node, []).append(agent)
+
+    def get_agent_keys(self, shuffle=False):
+        """
+        The ids of the travelling ants, then of the waiting ants node by node; the order a checkpoint restores the buckets in.
+        """
+        keys = list(self.moving) + [ant.unique_id for node in sorted(self.waiting) for ant in self.waiting[node]]
+        if shuffle:
+            self.model.random.shuffle(keys)
+        return keys
+
+    def step(self):
+        model = self.model
+        p0 = model.params['leave_home']
+        leavers = []
+        for node in sorted(self.waiting):
+            bucket = self.waiting[node]
+            if not bucket:
+                continue
+            if bucket[0].state == States.WAITING_HOME:
+                chance = p0
+            else:
+                chance = leave_chance(model.state.ants[node], p0)
+            leaving = model.rng.binomial(len(bucket), chance)
+            if leaving == 0:
+                continue
+            model.probe.count('transitions', leaving)
+            for i in sorted(model.rng.choice(len(bucket), leaving, replace=False).tolist(), reverse=True):
+                ant = bucket[i]
+                bucket[i] = bucket[-1] # swap out, the order of a bucket does not matter
+                bucket.pop()
+                ant.state = States.SEARCHING if ant.state == States.WAITING_HOME else States.RETURNING
+                leavers.append(ant)
+
+        movers = list(self.moving.values()) + leavers
+        model.random.shuffle(movers)
+        for ant in movers:
+            ant.move()
+            ant.update()
+            if ant.state == States.SEARCHING or ant.state == States.RETURNING:
+                self.moving[ant.unique_id] = ant
+            else:
+                self.moving.pop(ant.unique_id, None)
+                self.waiting.setdefault(ant.node, []).append(ant)
+
+        self.steps += 1
+        self.time += 1
+
+
 class TreeModel(Model):
     """
     TreeModel class has a tree, schedule (order in which to activate agents), grid (network), and a datacollector (what data to collect, position in this case)
+    Node and edge attributes live in a TreeState (model.state) while the model runs; call sync() to write them back to G and bring the grid up to date.
+    The datacollector is an OccupancyCollector keeping per-step node counts and per-ant position codes unless another one is passed in.
+    lazy_decay=True defers the pheromone decay of each edge until it is next read (see TreeState.set_decay), which pays off on large trees most edges of which stay unvisited.
+    activation is the scheduler class: ActiveActivation (bulk departures of waiting ants, only travelling ants activated) by default, or mesa.time.RandomActivation to activate every ant every step.
+    instrument=True records the time of each phase of every step, counts of moves, u-turns, deposits and state transitions, and the collector's memory; see report().
     """
-    def __init__(self, G, pop):
+    def __new__(cls, *args, **kwargs):
+        return Model.__new__(cls) # the seed is handled in __init__, Model.__new__ only accepts python random seeds
+
+    def __init__(self, G, pop, seed=None, datacollector=None, params=None, lazy_decay=False, activation=ActiveActivation, instrument=False):
         self.G = G
-        self.schedule = RandomActivation(self)
+        self.probe = Probe() if instrument else NULL_PROBE
+        self.rng = np.random.default_rng(seed)
+        self.random = ModelRandom(self.rng) # used by RandomActivation and every AgAnt decision
+        self.params = dict(parameters, **(params or {})) # this model's own copy, so models with different parameters can coexist
+        G.graph['parameters'] = self.params
+        self.state = TreeState(G)
+        self.state.clear() # a reused tree still carries the 'ants' and 'p' of its last run
+        G.graph['state'] = self.state
+        self.state.set_decay(self.params['pdecay_rate'], self.params['pdecay'], lazy=lazy_decay)
+        self.turns = TurnTable(self.state, self.params, pheromone=True)
+        self.schedule = activation(self)
         self.grid = NetworkGrid(self.G)
+        self.ant_list = []
         for i in range(pop):
             ant = AgAnt(i, self)
 
+            self.ant_list.append(ant)
             self.schedule.add(ant)
             self.grid.place_agent(ant, 'O')
-        ants = {'O' : {'ants' : pop}}
-        set_node_attributes(self.G, ants)
+        self.state.ants[self.state.index['O']] = pop
 
-        self.datacollector = DataCollector(agent_reporters={'Position' : "pos"})
+        self.datacollector = datacollector if datacollector is not None else OccupancyCollector(positions=True)
+        self.datacollector.bind(self)
         
     
     
     def step(self):
-        self.datacollector.collect(self)
-        self.schedule.step()
-        self.updatep(self.G)
+        probe = self.probe
+        with probe.phase('collect'):
+            self.datacollector.collect(self)
+        with probe.phase('schedule'):
+            self.schedule.step()
+        with probe.phase('decay'):
+            self.updatep()
+        probe.end_step(self)
+
+    def report(self):
+        """
+        Returns the instrumentation of an instrument=True model: one row per step with the seconds spent in each phase, the event counters and collector_bytes.
+        """
+        return self.probe.report()
+
+    def positions(self):
+        """
+        Returns the node id of every ant, in AgentID order.
+        """
+        return np.fromiter((ant.node for ant in self.ant_list), dtype=np.int64, count=len(self.ant_list))
+
+    def save_checkpoint(self, path):
+        """
+        Saves the run so far (every ant's position and state, node ants, edge p, the random stream and the step) to path as a compressed .npz of arrays.
+        """
+        approach = np.fromiter((ant.approach for ant in self.ant_list), dtype=np.int64, count=len(self.ant_list))
+        order = np.array(self.schedule.get_agent_keys(), dtype=np.int64)
+        checkpoint.save(path, self, self.schedule.steps, approach=approach, order=order, status=np.fromiter((ant.state.value for ant in self.ant_list), dtype=np.uint8, count=len(self.ant_list)))
+
+    @classmethod
+    def load_checkpoint(cls, path, G=None, datacollector=None, activation=ActiveActivation, seed=None):
+        """
+        Rebuilds a model saved with save_checkpoint on its tree G (default_tree() when omitted), ready to continue from the saved step with the same random stream (and the same activation).
+        Data collection starts afresh in datacollector. Loading one checkpoint many times forks runs from the same warmed-up state; give each fork its own seed, which reseeds both model.rng and model.random.
+        """
+        G = default_tree() if G is None else G
+        meta, arrays = checkpoint.load(path, cls)
+        model = cls(G, 0, datacollector=OccupancyCollector(), params=meta['params'], lazy_decay=meta['decay'][2], activation=activation)
+        state = model.state
+        for i, approach in enumerate(arrays['approach'].tolist()):
+            ant = AgAnt(i, model)
+            ant.approach = approach
+            ant.node = int(state.approach_node[approach])
+            prev = state.approach_prev[approach]
+            ant.ppos = state.names[prev] if prev >= 0 else None
+            ant.state = States(int(arrays['status'][i]))
+            model.ant_list.append(ant)
+            model.grid.place_agent(ant, state.names[ant.node])
+        for i in arrays['order'].tolist(): # in the scheduler's own order, so its buckets come back as they were
+            model.schedule.add(model.ant_list[i])
+        checkpoint.restore(model, meta, arrays, seed)
+        model.schedule.steps = model.schedule.time = meta['steps']
+        model.datacollector = datacollector if datacollector is not None else OccupancyCollector(positions=True)
+        model.datacollector.bind(model) # built with no ants, so the collector is sized only now
+        return model
+
+    def sync(self):
+        """
+        Writes the TreeState back to G and rebuilds the grid's agent lists from every ant's pos (ants only update pos while the model runs).
+        """
+        self.state.sync(self.G)
+        for node in self.G:
+            self.G.nodes[node]['agent'] = []
+        for ant in self.ant_list:
+            self.G.nodes[ant.pos]['agent'].append(ant)
     
-    def updatep(self, G):
+    def updatep(self, G=None):
         """
-        Updates pheromones based on pdecay, but doesn't go below 0.
+        Updates pheromones based on pdecay_rate and pdecay, but doesn't go below 0. The whole pheromone array of model.state is decayed in one operation
+        (or, with lazy_decay, each edge catches up when it is next read). G is accepted for compatibility; sync() writes the pheromone back to it.
         """
-        p = get_edge_attributes(G,'p')
-        for key in p:
-            p[key] = p[key] + parameters['pdecay']
-            if p[key] < 0:
-                p[key] = 0
+        self.state.decay()
+        if not self.state.lazy:
+            self.turns.refresh()
 
 
 
 
-def sim(n = 10, ants = 100, data = False):
+##################################
+#        Vectorized Engine       #
+##################################
+
+Moves = namedtuple('Moves', ['movers', 'before', 'moved', 'returning', 'leaving', 'changed'])
+
+def advance(state, approach, status, crowd, arrive, p0, rng, sample, probe=NULL_PROBE):
     """
-    Sim runs a model for n steps on ants ants, and returns either the tree on its own or the data too if specified. The default tree is provided below.
+    The step kernel of the numpy colony engines (VectorTreeModel, distributed.sim), advancing the ants in approach and status (TreeState approach ids and States values, updated in place).
+    Waiting ants leave, with p0 ('leave_home') at home and leave_chance of crowd (the population of each ant's node) at a nest; every travelling ant then takes the approach
+    sample(movers, before, draws) picks for it, and takes on the arrive state (arrive_table) of the node it reaches. The draws are one per ant for leaving, then one per mover.
+    Output: Moves(movers, before, moved, returning, leaving, changed): the moving ants, the approaches they left and took, which of them deposit 'padd' on state.edge[moved]
+    (the returning ones, applied by the caller to its own pheromone), the ants that left and the movers whose state their arrival changed.
     """
-    model = TreeModel(construct_tree(balanced_tree(depth=5, weight_map = [0.338,0.253,0.253,0.253,0.338,0.45,0.253,0.338,0.338,0.45,0.6,0.45,0.338,0.45,0.253,0.338,0.338,0.45,0.253,0.338,0.253,0.338,0.253,0.253,0.45,0.6,0.338,0.45,0.338,0.45,0.338,0.253])), ants)
+    with probe.phase('leave'):
+        waiting_home = status == States.WAITING_HOME.value
+        waiting_nest = status == States.WAITING_NEST.value
+        chance = np.where(waiting_home, p0, leave_chance(crowd, p0))
+        leaving = (waiting_home | waiting_nest) & (rng.random(len(status)) < chance)
+        status[leaving & waiting_home] = States.SEARCHING.value
+        status[leaving & waiting_nest] = States.RETURNING.value
+
+    movers = np.flatnonzero((status == States.SEARCHING.value) | (status == States.RETURNING.value))
+    before = approach[movers]
+    if len(movers) == 0:
+        return Moves(movers, before, before, np.zeros(0, dtype=bool), leaving, np.zeros(0, dtype=bool))
+    with probe.phase('move'):
+        moved = sample(movers, before, rng.random(len(movers)))
+        returning = status[movers] == States.RETURNING.value
+        approach[movers] = moved
+        arrived = arrive[state.approach_node[moved]]
+        changed = (arrived >= 0) & (arrived != status[movers])
+        status[movers] = np.where(arrived >= 0, arrived, status[movers])
+    return Moves(movers, before, moved, returning, leaving, changed)
+
+
+class VectorTreeModel:
+    """
+    VectorTreeModel is a NumPy alternative to TreeModel with the same step()/G interface. Ant states are a uint8 array of States values, positions are TreeState approach ids,
+    edge pheromone is a float array and node populations an int array. Every step draws once for all waiting ants, moves every travelling ant with one batched draw,
+    scatter-adds the 'padd' deposits of returning ants and decays the whole pheromone array at once (or lazily, edge by edge, with lazy_decay=True).
+    Ants decide from the state at the start of the step (a synchronous update), where TreeModel lets each ant see the moves made earlier in its step.
+    """
+    def __init__(self, G, pop, seed=None, datacollector=None, params=None, lazy_decay=False, instrument=False):
+        self.G = G
+        self.probe = Probe() if instrument else NULL_PROBE
+        self.steps = 0
+        self.params = dict(parameters, **(params or {}))
+        G.graph['parameters'] = self.params
+        self.state = TreeState(G)
+        self.state.clear() # a reused tree still carries the 'ants' and 'p' of its last run
+        self.state.set_decay(self.params['pdecay_rate'], self.params['pdecay'], lazy=lazy_decay)
+        self.rng = np.random.default_rng(seed)
+
+        self.approach = np.full(pop, self.state.start('O'), dtype=np.int64)
+        self.status = np.full(pop, States.WAITING_HOME.value, dtype=np.uint8)
+        self.state.ants[:] = np.bincount(self.pos, minlength=len(self.state.names))
+        self.turns = TurnTable(self.state, self.params, pheromone=True)
+        G.graph['state'] = self.state
+
+        self.arrive = arrive_table(self.state, ARRIVE) # -1 for plain junctions
+
+        self.datacollector = datacollector if datacollector is not None else OccupancyCollector(positions=True)
+        self.datacollector.bind(self)
+
+    @property
+    def pos(self):
+        return self.state.approach_node[self.approach]
+
+    @property
+    def ppos(self):
+        return self.state.approach_prev[self.approach]
+
+    def step(self):
+        probe = self.probe
+        with probe.phase('collect'):
+            self.datacollector.collect(self)
+        self.steps += 1
+        step = advance(self.state, self.approach, self.status, self.state.ants[self.pos], self.arrive, self.params['leave_home'], self.rng,
+            lambda movers, before, draws: self.turns.sample(before, draws), probe)
+
+        if len(step.movers):
+            with probe.phase('deposit'):
+                edges, deposits = np.unique(self.state.edge[step.moved[step.returning]], return_counts=True)
+                self.state.settle(edges)
+                self.state.p[edges] += self.params['padd'] * deposits
+
+            with probe.phase('move'):
+                nodes = len(self.state.names)
+                self.state.ants -= np.bincount(self.state.approach_node[step.before], minlength=nodes)
+                self.state.ants += np.bincount(self.state.approach_node[step.moved], minlength=nodes)
+
+            if probe.enabled:
+                probe.count('moves', len(step.movers))
+                probe.count('uturns', int((self.state.approach_node[step.moved] == self.state.approach_prev[step.before]).sum()))
+                probe.count('deposits', int(step.returning.sum()))
+                probe.count('transitions', int(step.changed.sum()))
+        if probe.enabled:
+            probe.count('transitions', int(step.leaving.sum()))
+
+        with probe.phase('decay'):
+            self.state.decay()
+            if not self.state.lazy:
+                self.turns.refresh()
+        probe.end_step(self)
+
+    def report(self):
+        return self.probe.report()
+
+    def sync(self):
+        self.state.sync(self.G)
+
+    def positions(self):
+        return self.pos
+
+    def save_checkpoint(self, path):
+        """
+        Saves the run so far (ant approaches and states, node ants, edge p, the generator and the step) to path as a compressed .npz of arrays.
+        """
+        checkpoint.save(path, self, self.steps, approach=self.approach, status=self.status)
+
+    @classmethod
+    def load_checkpoint(cls, path, G=None, datacollector=None, seed=None):
+        """
+        Rebuilds a model saved with save_checkpoint on its tree G (default_tree() when omitted), ready to continue from the saved step. Data collection starts afresh in datacollector; seed forks the run onto a new random stream.
+        """
+        G = default_tree() if G is None else G
+        meta, arrays = checkpoint.load(path, cls)
+        model = cls(G, len(arrays['approach']), datacollector=datacollector, params=meta['params'], lazy_decay=meta['decay'][2])
+        model.approach[:] = arrays['approach']
+        model.status[:] = arrays['status']
+        checkpoint.restore(model, meta, arrays, seed)
+        model.steps = meta['steps']
+        return model
+
+
+class EnsembleTreeModel:
+    """
+    EnsembleTreeModel runs replicates independent colonies of VectorTreeModel on the same tree at once. Ant states and approaches are (replicates x pop) arrays,
+    node populations (ants) are (replicates x nodes) and every replicate has its own pheromone vector (p, replicates x edges), so each step leaves, moves, deposits and decays
+    every ant of every replicate in one pass. Each step compiles one cumulative turn table per replicate (TurnTable.cumulative over the stacked pheromone) and samples every moving ant from its replicate's rows.
+    Pheromone decays eagerly; state is the shared tree and its own ants and p are left untouched.
+    """
+    def __init__(self, G, pop, replicates, seed=None, params=None):
+        self.G = G
+        self.steps = 0
+        self.params = dict(parameters, **(params or {}))
+        G.graph['parameters'] = self.params
+        self.state = TreeState(G)
+        self.state.clear() # a reused tree still carries the 'ants' and 'p' of its last run
+        self.rng = np.random.default_rng(seed)
+        self.turns = TurnTable(self.state, self.params) # for its base weights, biases and candidate edges
+
+        self.approach = np.full((replicates, pop), self.state.start('O'), dtype=np.int64)
+        self.status = np.full((replicates, pop), States.WAITING_HOME.value, dtype=np.uint8)
+        self.ants = np.zeros((replicates, len(self.state.names)), dtype=np.int64)
+        self.ants[:, self.state.index['O']] = pop
+        self.p = np.tile(self.state.p, (replicates, 1))
+        self.arrive = arrive_table(self.state, ARRIVE)
+
+    def step(self):
+        self.steps += 1
+        replicates, pop = self.approach.shape
+        nodes = len(self.state.names)
+        status = self.status.reshape(-1)
+        approach = self.approach.reshape(-1)
+        pos = self.state.approach_node[approach]
+        replicate = np.repeat(np.arange(replicates), pop)
+
+        # Waiting ants leave with 'leave_home' at home, or the logistic chance of their nest's population in their own replicate
+        waiting_home = status == States.WAITING_HOME.value
+        waiting_nest = status == States.WAITING_NEST.value
+        p0 = self.params['leave_home']
+        chance = np.where(waiting_home, p0, leave_chance(self.ants.reshape(-1)[replicate * nodes + pos], p0))
+        leaving = (waiting_home | waiting_nest) & (self.rng.random(len(pos)) < chance)
+        status[leaving & waiting_home] = States.SEARCHING.value
+        status[leaving & waiting_nest] = States.RETURNING.value
+
+        movers = np.flatnonzero((status == States.SEARCHING.value) | (status == States.RETURNING.value))
+        if len(movers):
+            before = approach[movers]
+            cum = self.turns.cumulative(self.p) # every replicate's table in one pass
+            rows = replicate[movers] * len(self.turns.last) + before
+            moved = self.state.first[before] + choose(cum.reshape(-1, cum.shape[2]), rows, self.rng.random(len(movers)))
+
+            returning = status[movers] == States.RETURNING.value
+            edges = len(self.state.p)
+            self.p += self.params['padd'] * np.bincount(replicate[movers][returning] * edges + self.state.edge[moved[returning]], minlength=replicates * edges).reshape(replicates, edges)
+
+            self.ants -= np.bincount(replicate[movers] * nodes + self.state.approach_node[before], minlength=replicates * nodes).reshape(replicates, nodes)
+            self.ants += np.bincount(replicate[movers] * nodes + self.state.approach_node[moved], minlength=replicates * nodes).reshape(replicates, nodes)
+            approach[movers] = moved
+
+            arrived = self.arrive[self.state.approach_node[moved]]
+            status[movers] = np.where(arrived >= 0, arrived, status[movers])
+
+        np.maximum(self.p * (1 - self.params['pdecay_rate']) + self.params['pdecay'], 0, out=self.p)
+
+
+class NestConvergence:
+    """
+    Tracks the ants in every nest after each step, and reports convergence once no nest's count has moved by more than tol times the population for window consecutive steps.
+    """
+    def __init__(self, state, pop, window=50, tol=0.01):
+        self.state = state
+        self.nests = np.flatnonzero(state.nest)
+        self.history = np.empty((window, len(self.nests)), dtype=np.int64) # ring buffer of the last window nest counts
+        self.seen = 0
+        self.limit = tol * pop
+
+    def converged(self):
+        window = len(self.history)
+        self.history[self.seen % window] = self.state.ants[self.nests]
+        self.seen += 1
+        if self.seen < window:
+            return False
+        return (self.history.max(axis=0) - self.history.min(axis=0)).max() <= self.limit
+
+def default_tree():
+    """
+    Returns a freshly built copy of the default tree sim() runs on.
+    """
+    return construct_tree(balanced_tree())
+
+def sim(n = 10, ants = 100, data = False, engine = 'mesa', G = None, params = None, seed = None, early_stop = False, window = 50, tol = 0.01, cache = False):
+    """
+    Sim runs a model for n steps on ants ants, and returns either the tree on its own or the data too if specified. The default tree is given by default_tree().
+    engine picks the implementation: 'mesa' (TreeModel, one agent at a time) or 'numpy' (VectorTreeModel, whole colony per step).
+    G runs on a given tree instead of the default one, params overrides entries of the module-level parameters for this run only, and seed (an int, SeedSequence or Generator) seeds the model's random stream.
+    early_stop = True stops once the colony has settled: the ants in every nest stayed within tol * ants of each other for window steps (see NestConvergence). The data then ends at that step.
+    cache = True (or a result_cache.ResultCache) returns a stored copy of a run with the same parameters, tree, arguments, seed (an int or SeedSequence) and model source,
+    and stores the run otherwise, so repeating a call only costs loading its arrays.
+    """
+    if G is None:
+        G = default_tree()
+    if cache:
+        full = dict(parameters, **(params or {}))
+        results, key, hit = result_cache.lookup(cache, __name__, G, full, seed, n=n, ants=ants, data=data, engine=engine, early_stop=early_stop, window=window, tol=tol)
+        if hit is not None:
+            collector = result_cache.restore(G, full, hit)
+            if data:
+                return G, collector.get_agent_vars_dataframe()
+            return G
+    collector = OccupancyCollector(positions=data, steps=n)
+    if engine == 'numpy':
+        model = VectorTreeModel(G, ants, seed=seed, datacollector=collector, params=params)
+    elif engine == 'mesa':
+        model = TreeModel(G, ants, seed=seed, datacollector=collector, params=params)
+    else:
+        raise ValueError(f"unknown engine {engine!r}, expected 'mesa' or 'numpy'")
+
+    convergence = NestConvergence(model.state, ants, window, tol) if early_stop else None
     for i in range(n):
         model.step()
-        
+        if convergence is not None and i < n-1 and convergence.converged():
+            collector.collect(model) # the state the stop was decided on, which the next step would have collected
+            break
+    model.sync()
+    collector.close()
+    if cache:
+        result_cache.store(results, key, model, collector)
+
     if data:
         return model.G, model.datacollector.get_agent_vars_dataframe()
     #can use model.datacollector.agent_reporters to get info if needed.
     return model.G
 
-def experiment(n=50, ants = 1000,relabel=True):
+def ensemble(n = 10, ants = 100, replicates = 100, G = None, params = None, seed = None):
+    """
+    ensemble runs replicates independent colonies of n steps on ants ants at once (EnsembleTreeModel), for confidence intervals without a loop over sim() calls.
+    G, params and seed work as in sim; the replicates share the one seeded stream, so the same seed gives the same ensemble.
+    Output: the (replicates x n x nodes) occupancy cube (int32, or int64 past 2**31-1 ants), nodes in G.nodes() order. Every replicate has the distribution of sim(n, ants, engine='numpy').
+    """
+    if G is None:
+        G = default_tree()
+    model = EnsembleTreeModel(G, ants, replicates, seed=seed, params=params)
+    cube = np.empty((replicates, n, len(model.state.names)), dtype=count_dtype(ants))
+    for i in range(n):
+        cube[:, i] = model.ants # collected before the step, like the collectors of sim
+        model.step()
+    return cube
+
+def experiment(n=50, ants = 1000,relabel=True, seed=None, cache=False):
     """
     experiment simply calls sim then draws the graphs. relabel true means clockwise labels, false means lab labels.
+    seed and cache are passed to sim, so experiment(50, 1000, seed=1, cache=True) only simulates the first time.
     Sample run: experiment(50,1000)
     """
-    G,data = sim(n,ants,True)
+    G,data = sim(n,ants,True,seed=seed,cache=cache)
     graph_draw(G,data,relabel)
 
 
 
+
+def animate(path, n = 1000, ants = 1000, engine = 'numpy', G = None, params = None, seed = None, **options):
+    """
+    animate runs a model for n steps like sim and renders the ants on every node and the pheromone on every edge at every step to path,
+    a directory of frames, a .gif or a video, without a display. options go to frames.render (every, fps, workers, layout, size, cmap, ...).
+    Output: the number of frames written. Sample run: animate('colony.gif', 1000, 1000)
+    """
+    if G is None:
+        G = default_tree()
+    collector = OccupancyCollector(steps=n, pheromone=True)
+    if engine == 'numpy':
+        model = VectorTreeModel(G, ants, seed=seed, datacollector=collector, params=params)
+    elif engine == 'mesa':
+        model = TreeModel(G, ants, seed=seed, datacollector=collector, params=params)
+    else:
+        raise ValueError(f"unknown engine {engine!r}, expected 'mesa' or 'numpy'")
+    for i in range(n):
+        model.step()
+    collector.close()
+    return render(G, collector.occupancy(), path, pheromone=collector.pheromone_history(), node_color=node_colors(G), **options)
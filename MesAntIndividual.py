@@ -1,18 +1,18 @@
 from mesa import Agent, Model
 from mesa.time import RandomActivation
 from mesa.space import NetworkGrid
-from mesa.datacollection import DataCollector
-from networkx.classes.function import get_node_attributes, set_node_attributes
 import time, enum, math
 import numpy as np
-import pandas as pd
-import pylab as plt
 import networkx as nx
-from networkx.drawing.nx_agraph import write_dot, graphviz_layout, read_dot
-import matplotlib.pyplot as plt
-import matplotlib.colors as clr
-import itertools
-import random
+from occupancy import OccupancyCollector, occupancy_timeseries, count_dtype
+from seeding import ModelRandom
+from instrument import Probe, NULL_PROBE
+import checkpoint
+import result_cache
+from tree_build import balanced_tree, tree_edges
+from layout import tree_layout, tip_positions, clockwise_labels, LAB_LABELS
+from frames import render
+from tree_state import TreeState
 
 ##################################
 #           Parameters           #
@@ -29,61 +29,50 @@ parameters = {
 #       Tree Construction        #
 ##################################
 
-def balanced_tree(depth=5, weight_map = [0.338,0.253,0.253,0.253,0.338,0.45,0.253,0.338,0.338,0.45,0.6,0.45,0.338,0.45,0.253,0.338,0.338,0.45,0.253,0.338,0.253,0.338,0.253,0.253,0.45,0.6,0.338,0.45,0.338,0.45,0.338,0.253]):
+def construct_tree(leaves=None):
     """
-    Inputs: a 'depth' of the tree and a map of the weights of the leaves. Weights proceed from left most tip and then clock-wise around the tree.
-    Output: a dictionary of leaf names with LR nomenclature and corresponding weights
+    Input: a dictionary of leaf names and branch widths leading to the leaves (balanced_tree() when omitted). Leaves are named with the convention 'LRLLRL', dictating how to get to the leaf.
+    Outputs: a tree constructed in networkx following the tree building rules (joining of LR names and weights), built in linear time by tree_edges.
+    Every node also gets an integer 'id', its position in G.nodes() (and in TreeState.names), so names and ids map both ways.
     """
-    leaf_names = []
-    uniques = list(''.join(tup) for tup in itertools.product('LR', repeat = depth))
-    weight_map.reverse()
-    for i in range(2**depth):
-        leaf_names += ['O'+ uniques[i]]
-
-    leafd = {}
-    i=0
-    for leaf in leaf_names:
-        leafd[leaf] = weight_map[i]
-        i+=1
-
-    return leafd
-
-def construct_tree(leaves=balanced_tree()):
-    """
-    Input: a dictionary of leaf names and branch widths leading to the leaves. Leaves are named with the convention 'LRLLRL', dictating how to get to the leaf.
-    Outputs: a tree constructed in networkx following the tree building rules (joining of LR names and weights).
-    """
-    leafd = leaves
+    names, edges = tree_edges(balanced_tree() if leaves is None else leaves)
+    tips = len(names) - len(edges)//2
     G = nx.Graph()
-    for leaf in leafd:
-        G.add_node(leaf, nest=True, ants=0)
-
-    while not 'O' in leafd:
-
-        leaf = list(leafd.keys())[0]
-
-        for leaf2 in leafd:
-            if leaf2 != leaf and len(leaf2) == len(leaf):
-                if leaf2[:len(leaf2)-1] == leaf[:len(leaf)-1]:
-                    junc = leaf[:len(leaf)-1] # The junction between two nodes is their name with the last letter cut off
-                    G.add_node(junc, nest = False, ants=0)
-
-                    G.add_edge(junc, leaf2, weight = leafd[leaf2])
-                    G.add_edge(junc, leaf, weight = leafd[leaf])
-                    
-                    
-                    leafd[junc] = (leafd[leaf] if leafd[leaf] > leafd[leaf2] else leafd[leaf2])
-                    del leafd[leaf]
-                    del leafd[leaf2]
-                    break
-    
+    G.add_nodes_from((name, {'nest' : i < tips, 'ants' : 0, 'id' : i}) for i, name in enumerate(names))
+    G.add_edges_from((junc, leaf, {'weight' : weight}) for junc, leaf, weight in edges)
     return G
     
+def node_colors(G):
+    """
+    The colors graph_draw gives the nodes of G, in G.nodes() order: nests are colored by their clockwise group of four tips (tip_positions), the groups spread
+    evenly over eight tab colors (one color per letter A-H on the default tree) and fading with the digit, red for home 'O' and blue otherwise.
+    """
+    import matplotlib.colors as clr
+    positions, slots = tip_positions(G)
+    groups = max(1, slots // 4)
+    colors = ['tab:blue', 'tab:orange', 'tab:green','tab:red', 'tab:purple', 'tab:brown', 'tab:pink', 'tab:olive']
+    color_map = []
+    for name, nest in G.nodes(data='nest'):
+        if nest == True:
+            k = positions.get(name, 0)
+            color = clr.to_rgba(colors[(k//4) * len(colors) // groups])
+            color = (color[0],color[1],color[2], color[3]*((k%4)/3.5) +0.14)
+            color_map.append(color)
+        elif name == 'O':
+            color_map.append(clr.to_rgba('red')) 
+        else: 
+            color_map.append(clr.to_rgba('blue')) 
+    return color_map
+
 def graph_draw(G,data,labels_ordered=True):
     """
     Inputs: G, a tree in networkx and data from the Mesa model. Data is in the form of dictionary with time steps. Gross conversions proceed. Labels_ordered dictacts what naming scheme to use (True = clockwise, False = lab).
     Output: draws a networkx plot and an area plot from a pandas dataframe
     """
+    import matplotlib.pyplot as plt # plotting is only loaded to draw, so sim() runs without matplotlib
+    import matplotlib.colors as clr
+    if 'state' in G.graph: # write back the attributes of a model that is still running
+        G.graph['state'].sync(G)
     datan = list(G.nodes(data=True))
     nodes = G.nodes()
     node_size_map = []
@@ -92,28 +81,14 @@ def graph_draw(G,data,labels_ordered=True):
         node_size_map+=[datan[i][1]['ants'] *10 + 20]
         i+=1
 
-    G = nx.relabel_nodes(G, lambda name: (int(name.replace('L','0').replace('R','1')[1:],2)+1) if len(name) == 6 else name)
-    G = nx.relabel_nodes(G, lambda name: (chr(((name-1)//4) + 65) + str((name-1)%4) if isinstance(name,int) else name)) # Changes node labels from LR to clockwise
-    pos = graphviz_layout(G, prog = 'twopi') #prog = 'dot' for other view
-    plt.title(str(parameters))
+    clockwise = clockwise_labels(G) # computed once per tree topology, like the layout
+    color_map = node_colors(G)
+    pos = tree_layout(G)
+    G = nx.relabel_nodes(G, clockwise) # Changes node labels from LR to clockwise
+    pos = {clockwise.get(node, node): xy for node, xy in pos.items()}
+    plt.title(str(G.graph.get('parameters', parameters)))
     
     
-    colors = ['tab:blue', 'tab:orange', 'tab:green','tab:red', 'tab:purple', 'tab:brown', 'tab:pink', 'tab:olive']
-    color_map = []
-    datan = list(G.nodes(data=True))
-    i = 0
-    for node in G:
-        if datan[i][1]['nest'] == True:
-            color = clr.to_rgba(colors[ord(node[0])-65])
-            color = (color[0],color[1],color[2], color[3]*(int(node[1])/3.5) +0.14)
-            color_map.append(color)
-        elif node == 'O':
-            color_map.append(clr.to_rgba('red')) 
-        else: 
-            color_map.append(clr.to_rgba('blue')) 
-        i+=1
-
-    
     color_map_edge = []
 
     weight_map = [G[u][v]['weight'] * 5 for u,v in G.edges()]
@@ -128,9 +103,8 @@ def graph_draw(G,data,labels_ordered=True):
             color_map_edge += ['black']
 
     if not labels_ordered:
-        d = {"C0":'1111',"C1":'1112',"C2":'1121',"C3":'1122','D0':'1211','D1':'1212','D2':'1221','D3':'1222','G0':'2111','G1':'2112','G2':'2121','G3':'2122','H0':'2211','H1':'2212','H2':'2221','H3':'2222','A0':'311','A1':'312','A2':'321','A3':'322','E0':'411','E1':'412','E2':'421','E3':'422','B0':'51','B1':'52','F2':'61','F3':'62','B2':'71','B3':'72','F0':'81','F1':'82'}
-        G = nx.relabel_nodes(G, d)
-        pos = graphviz_layout(G, prog = 'twopi')
+        G = nx.relabel_nodes(G, LAB_LABELS)
+        pos = {LAB_LABELS.get(node, node): xy for node, xy in pos.items()}
 
     name_map = {}
     for node in G.nodes():
@@ -142,33 +116,18 @@ def graph_draw(G,data,labels_ordered=True):
     nx.draw_networkx_labels(G,pos,name_map,font_size=16,font_color='black')
     plt.gca().invert_xaxis()
    
-    # Creating the area plot
-    datadict = {}
-    datadictlist = [datadict]
-    for i in range(int(len(data['Position'])/len(data['Position'][0]))):
-        
-        for k in range(len(data['Position'][i])):
-            if not data['Position'][i][k] in datadict:
-                datadict[data['Position'][i][k]] = 1
-            else:
-                datadict[data['Position'][i][k]] += 1
-
-        for node in nodes:
-            if not node in datadict:
-                datadict[node] = 0
-            
-
-        datadictlist+=[datadict]
-        datadict = {}
-    datadictlist = datadictlist[1:]
-
-    ax = pd.DataFrame(datadictlist).plot.area(colormap=clr.ListedColormap([color_map[-1]]+color_map[:-1]))
+    # Creating the area plot, home node first
+    order = ['O'] + [node for node in nodes if node != 'O']
+    colors_by_node = dict(zip(nodes, color_map))
+    occupancy = occupancy_timeseries(data, order)
+
+    ax = occupancy.plot.area(colormap=clr.ListedColormap([colors_by_node[node] for node in order]))
     
     ax.set_ylabel('ants')
     ax.set_xlabel('time')
 
     ax.get_legend().remove()
-    plt.title(str(parameters))
+    plt.title(str(G.graph.get('parameters', parameters)))
     
     plt.show()
 
@@ -180,100 +139,47 @@ class AgAnt(Agent):
     """
     The AgAnt class is a custom agent class in mesa, with unique ids and created in a specified model. They store information about their position (node O to start) and previous positions.
     They make decisions about where to move based on their previous position, current poisiont, and biases. Agents do not interact in this model.
+    Alongside the node names used by the grid, ants keep the integer id of their node so they read and write the model's TreeState directly.
     """
     def __init__(self,unique_id,model):
         super().__init__(unique_id,model)
         self.pos = 'O'
         self.ppos = None
+        self.node = model.state.index['O']
+        self.approach = model.state.start('O') # (ppos, pos) as one TreeState approach id
 
-    def choice(self,neighbors):
+    def choice(self):
         """
-        Inputs: self, list of neighbors.
-        Outputs: A choice of neighbor to move to next based on the options availible and biases.
+        Inputs: self.
+        Outputs: the approach (current node -> next node) the ant takes, drawn with one uniform draw from the model's TurnTable, which holds the width, left/right and u-turn biased probabilities for every (previous node, current node).
         """
-        if len(neighbors) == 1:
-                return neighbors[0]
-        
-        else:
-            for i in range(len(neighbors)):
-                neighbors[i] = [neighbors[i] , self.model.G.get_edge_data(self.pos, neighbors[i])]
-
-            if len(neighbors) == 2:
-                probs = [neighbors[0][1]['weight'],neighbors[1][1]['weight']]
-
-                for i in range(len(probs)):
-                    probs[i] **= parameters['width']
-                    if neighbors[i][0][-1] == 'L':
-                        probs[i] *= parameters['left']
-                    elif neighbors[i][0][-1] == 'R':
-                        probs[i] *= parameters['right']
-                    else:
-                        probs[i] *= parameters['u-turn']
-
-                total = probs[0]+probs[1]
-                probs[0] = probs[0]/total
-                probs[1] = probs[1]/total
-            
-                r = random.random()
-                if r < probs[0]:
-                    return neighbors[0][0]
-                else:
-                    return neighbors[1][0]
-
-            else: 
-
-                probs = [neighbors[0][1]['weight'],neighbors[1][1]['weight'],neighbors[2][1]['weight']]
-                
-                if len(self.ppos) < len(self.pos): #if facing 'forwards'
-                    for i in range(len(probs)):
-                        
-                        probs[i] **= parameters['width']
-                        if neighbors[i][0] == self.ppos:
-                            probs[i] *= parameters['u-turn']
-                        elif neighbors[i][0][-1] == 'L':
-                            probs[i] *= parameters['left']
-                        elif neighbors[i][0][-1] == 'R':
-                            probs[i] *= parameters['right']
-                else: #if facing 'backwards'
-                    for i in range(len(probs)):
-                        
-                        probs[i] **= parameters['width']
-                        if neighbors[i][0] == self.ppos:
-                            probs[i] *= parameters['u-turn']
-                        elif neighbors[i][0][-1] == 'L':
-                            probs[i] *= parameters['right']
-                        elif neighbors[i][0][-1] == 'R':
-                            probs[i] *= parameters['left']
-                        
-                total = probs[0]+probs[1]+probs[2]
-                probs[0] = probs[0]/total
-                probs[1] = probs[1]/total
-                probs[2] = probs[2]/total
-
-                r = random.random()
-                if r < probs[0]:
-                    return neighbors[0][0]
-                elif r < probs[0]+probs[1]:
-                    return neighbors[1][0]
-                else:
-                    return neighbors[2][0]
+        return int(self.model.turns.sample(self.approach, self.model.random.random()))
 
     def move(self):
         """
         Moves the ant if not at a nest, otherwise does not.
         """
-        
-        if get_node_attributes(self.model.G, 'nest')[self.pos]:
+        state = self.model.state
+        if state.nest[self.node]:
             return self.pos
         else:
-            neighbors = list(self.model.G.neighbors(self.pos))
-            
-            node = self.choice(neighbors)
+            previous = self.approach
+            self.approach = self.choice()
 
-            ants = {self.pos : {'ants' : get_node_attributes(self.model.G, 'ants')[self.pos] - 1}, node : { 'ants' : get_node_attributes(self.model.G, 'ants')[node] + 1}}
+            to = int(state.approach_node[self.approach])
+            state.move(self.node, to)
+            self.node = to
             self.ppos = self.pos
-            self.model.grid.move_agent(self, node)
-            set_node_attributes(self.model.G, ants)
+            node = state.names[to]
+            self.pos = node # the grid catches up at sync(), a move here would cost a list.remove per ant
+            if state.nest[to]:
+                self.model.schedule.remove(self) # stopped for good, so the schedule stops stepping it
+
+            probe = self.model.probe
+            if probe.enabled:
+                probe.count('moves')
+                probe.count('uturns', int(to == state.approach_prev[previous]))
+                probe.count('absorbed', int(state.nest[to]))
 
             return node
 
@@ -287,49 +193,507 @@ class AgAnt(Agent):
 class TreeModel(Model):
     """
     TreeModel class has a tree, schedule (order in which to activate agents), grid (network), and a datacollector (what data to collect, position in this case)
+    Node and edge attributes live in a TreeState (model.state) while the model runs; call sync() to write them back to G and bring the grid up to date.
+    The datacollector is an OccupancyCollector keeping per-step node counts and per-ant position codes unless another one is passed in.
+    Only ants still moving stay on the schedule: an ant that reaches a nest is removed from it, so absorbed ants cost nothing per step.
+    instrument=True records the time of each phase of every step, counts of moves, u-turns and absorbed ants, and the collector's memory; see report().
     """
 
-    def __init__(self, G, pop):
+    def __new__(cls, *args, **kwargs):
+        return Model.__new__(cls) # the seed is handled in __init__, Model.__new__ only accepts python random seeds
+
+    def __init__(self, G, pop, seed=None, datacollector=None, params=None, instrument=False):
         self.G = G
+        self.probe = Probe() if instrument else NULL_PROBE
+        self.rng = np.random.default_rng(seed)
+        self.random = ModelRandom(self.rng) # used by RandomActivation and every AgAnt decision
+        self.params = dict(parameters, **(params or {})) # this model's own copy, so models with different parameters can coexist
+        G.graph['parameters'] = self.params
+        self.state = TreeState(G)
+        self.state.clear() # a reused tree still carries the 'ants' and 'p' of its last run
+        G.graph['state'] = self.state
+        self.turns = self.state.turns(self.params)
         self.schedule = RandomActivation(self)
         self.grid = NetworkGrid(self.G)
+        self.ant_list = []
         for i in range(pop):
             ant = AgAnt(i, self)
 
+            self.ant_list.append(ant)
             self.schedule.add(ant)
             self.grid.place_agent(ant, 'O')
-        ants = {'O' : {'ants' : pop}}
-        set_node_attributes(self.G, ants)
+        self.state.ants[self.state.index['O']] = pop
 
-        self.datacollector = DataCollector(agent_reporters={'Position' : "pos"})
+        self.datacollector = datacollector if datacollector is not None else OccupancyCollector(positions=True)
+        self.datacollector.bind(self)
         
 
+    def step(self):
+        probe = self.probe
+        with probe.phase('collect'):
+            self.datacollector.collect(self)
+        with probe.phase('schedule'):
+            self.schedule.step()
+        probe.end_step(self)
+
+    def report(self):
+        """
+        Returns the instrumentation of an instrument=True model: one row per step with the seconds spent in each phase, the event counters and collector_bytes.
+        """
+        return self.probe.report()
+
+    def absorbed(self):
+        """
+        True once every ant has stopped at a nest.
+        """
+        return self.schedule.get_agent_count() == 0
+
+    def positions(self):
+        """
+        Returns the node id of every ant, in AgentID order.
+        """
+        return np.fromiter((ant.node for ant in self.ant_list), dtype=np.int64, count=len(self.ant_list))
+
+    def save_checkpoint(self, path):
+        """
+        Saves the run so far (every ant's position, node ants, the random stream and the step) to path as a compressed .npz of arrays.
+        """
+        approach = np.fromiter((ant.approach for ant in self.ant_list), dtype=np.int64, count=len(self.ant_list))
+        checkpoint.save(path, self, self.schedule.steps, approach=approach)
+
+    @classmethod
+    def load_checkpoint(cls, path, G=None, datacollector=None, seed=None):
+        """
+        Rebuilds a model saved with save_checkpoint on its tree G (default_tree() when omitted), ready to continue from the saved step with the same random stream.
+        Data collection starts afresh in datacollector. Loading one checkpoint many times forks runs from the same warmed-up state; give each fork its own seed, which reseeds both model.rng and model.random.
+        """
+        G = default_tree() if G is None else G
+        meta, arrays = checkpoint.load(path, cls)
+        model = cls(G, 0, datacollector=OccupancyCollector(), params=meta['params'])
+        state = model.state
+        for i, approach in enumerate(arrays['approach'].tolist()):
+            ant = AgAnt(i, model)
+            ant.approach = approach
+            ant.node = int(state.approach_node[approach])
+            prev = state.approach_prev[approach]
+            ant.ppos = state.names[prev] if prev >= 0 else None
+            model.ant_list.append(ant)
+            if not state.nest[ant.node]:
+                model.schedule.add(ant)
+            model.grid.place_agent(ant, state.names[ant.node])
+        checkpoint.restore(model, meta, arrays, seed)
+        model.schedule.steps = model.schedule.time = meta['steps']
+        model.datacollector = datacollector if datacollector is not None else OccupancyCollector(positions=True)
+        model.datacollector.bind(model) # built with no ants, so the collector is sized only now
+        return model
+
+    def sync(self):
+        """
+        Writes the TreeState back to G and rebuilds the grid's agent lists from every ant's pos (ants only update pos while the model runs).
+        """
+        self.state.sync(self.G)
+        for node in self.G:
+            self.G.nodes[node]['agent'] = []
+        for ant in self.ant_list:
+            self.G.nodes[ant.pos]['agent'].append(ant)
+
+##################################
+#        Vectorized Engine       #
+##################################
+
+class VectorTreeModel:
+    """
+    VectorTreeModel is a NumPy alternative to TreeModel with the same step()/G interface. Each ant is stored as one integer approach id of a TreeState (current and previous node together),
+    so the whole population is advanced per step with a single batched uniform draw against precomputed U/L/R transition probabilities. Ants at a nest are dropped from the active set and never drawn for again.
+    """
+    def __init__(self, G, pop, seed=None, datacollector=None, params=None, instrument=False):
+        self.G = G
+        self.probe = Probe() if instrument else NULL_PROBE
+        self.params = dict(parameters, **(params or {}))
+        G.graph['parameters'] = self.params
+        self.state = TreeState(G)
+        self.state.clear() # a reused tree still carries the 'ants' and 'p' of its last run
+        self.rng = np.random.default_rng(seed)
+        self.steps = 0
+        self.turns = self.state.turns(self.params)
+        self.moving = ~self.state.nest[self.state.approach_node] # ants on a nest approach stop, like AgAnt.move
+
+        self.approach = np.full(pop, self.state.start('O'), dtype=np.int64)
+        self.state.ants[:] = np.bincount(self.pos, minlength=len(self.state.names))
+        G.graph['state'] = self.state
+        self.active = np.flatnonzero(self.moving[self.approach])
+
+        self.datacollector = datacollector if datacollector is not None else OccupancyCollector(positions=True)
+        self.datacollector.bind(self)
+
+    @property
+    def pos(self):
+        return self.state.approach_node[self.approach]
+
+    @property
+    def ppos(self):
+        return self.state.approach_prev[self.approach]
+
+    def step(self):
+        probe = self.probe
+        with probe.phase('collect'):
+            self.datacollector.collect(self)
+        self.steps += 1
+        if len(self.active):
+            with probe.phase('move'):
+                approach = self.approach[self.active]
+                moved = self.turns.sample(approach, self.rng.random(len(approach)))
+
+                nodes = len(self.state.names)
+                self.state.ants -= np.bincount(self.state.approach_node[approach], minlength=nodes)
+                self.state.ants += np.bincount(self.state.approach_node[moved], minlength=nodes)
+                self.approach[self.active] = moved
+                self.active = self.active[self.moving[moved]]
+
+            if probe.enabled:
+                probe.count('moves', len(moved))
+                probe.count('uturns', int((self.state.approach_node[moved] == self.state.approach_prev[approach]).sum()))
+                probe.count('absorbed', int((~self.moving[moved]).sum()))
+        probe.end_step(self)
+
+    def report(self):
+        return self.probe.report()
+
+    def absorbed(self):
+        return len(self.active) == 0
+
+    def sync(self):
+        self.state.sync(self.G)
+
+    def positions(self):
+        return self.pos
+
+    def save_checkpoint(self, path):
+        """
+        Saves the run so far (ant approaches, node ants, the generator and the step) to path as a compressed .npz of arrays.
+        """
+        checkpoint.save(path, self, self.steps, approach=self.approach)
+
+    @classmethod
+    def load_checkpoint(cls, path, G=None, datacollector=None, seed=None):
+        """
+        Rebuilds a model saved with save_checkpoint on its tree G (default_tree() when omitted), ready to continue from the saved step. Data collection starts afresh in datacollector; seed forks the run onto a new random stream.
+        """
+        G = default_tree() if G is None else G
+        meta, arrays = checkpoint.load(path, cls)
+        model = cls(G, len(arrays['approach']), datacollector=datacollector, params=meta['params'])
+        model.approach[:] = arrays['approach']
+        model.active = np.flatnonzero(model.moving[model.approach])
+        checkpoint.restore(model, meta, arrays, seed)
+        model.steps = meta['steps']
+        return model
+
+##################################
+#          Count Engine          #
+##################################
+
+# Counts are moved with float64 bincount weights, which hold whole numbers exactly up to here
+MAX_COUNT = 2**53
+
+class CountTreeModel:
+    """
+    CountTreeModel evolves the individual model as counts instead of agents. Ants do not interact, so the whole population is a Markov chain over the directed states
+    (ppos, pos) of a TreeState (its approaches): every step the ants on each approach are split over its candidate moves with one multinomial draw, and ants on a nest stay put.
+    A step costs the same for a hundred ants as for a billion. There are no individual ants, so only node counts are collected (model.positions() does not exist).
+    """
+    def __init__(self, G, pop, seed=None, datacollector=None, params=None):
+        if not 0 <= pop <= MAX_COUNT:
+            raise ValueError(f'the counts engines run 0 to MAX_COUNT (2**53) ants, not {pop}')
+        self.G = G
+        self.params = dict(parameters, **(params or {}))
+        G.graph['parameters'] = self.params
+        self.state = TreeState(G)
+        self.state.clear() # a reused tree still carries the 'ants' and 'p' of its last run
+        self.rng = np.random.default_rng(seed)
+        self.steps = 0
+        self.probs = self.state.turns(self.params).probabilities()
+        self.moving = ~self.state.nest[self.state.approach_node]
+
+        self.counts = np.zeros(len(self.state.approach_node), dtype=np.int64) # ants per approach
+        self.counts[self.state.start('O')] = pop
+        self.state.ants[:] = np.bincount(self.state.approach_node, weights=self.counts, minlength=len(self.state.names)).astype(np.int64)
+        G.graph['state'] = self.state
+
+        self.datacollector = datacollector if datacollector is not None else OccupancyCollector()
+        self.datacollector.bind(self)
+
     def step(self):
         self.datacollector.collect(self)
-        self.schedule.step()
+        self.steps += 1
+        rows = np.flatnonzero((self.counts > 0) & self.moving)
+        if len(rows) == 0:
+            return
+
+        split = self.rng.multinomial(self.counts[rows], self.probs[rows])
+        self.counts[rows] = 0
+        self.counts += np.bincount(self.state.slot[rows].ravel(), weights=split.ravel(), minlength=len(self.counts)).astype(np.int64)
+        self.state.ants[:] = np.bincount(self.state.approach_node, weights=self.counts, minlength=len(self.state.names)).astype(np.int64)
+
+    def absorbed(self):
+        return not self.counts[self.moving].any()
+
+    def sync(self):
+        self.state.sync(self.G)
+
+    def save_checkpoint(self, path):
+        """
+        Saves the run so far (ants per approach, the generator and the step) to path as a compressed .npz of arrays.
+        """
+        checkpoint.save(path, self, self.steps, counts=self.counts)
+
+    @classmethod
+    def load_checkpoint(cls, path, G=None, datacollector=None, seed=None):
+        """
+        Rebuilds a model saved with save_checkpoint on its tree G (default_tree() when omitted), ready to continue from the saved step. Data collection starts afresh in datacollector; seed forks the run onto a new random stream.
+        """
+        G = default_tree() if G is None else G
+        meta, arrays = checkpoint.load(path, cls)
+        model = cls(G, 0, datacollector=datacollector, params=meta['params'])
+        model.counts[:] = arrays['counts']
+        checkpoint.restore(model, meta, arrays, seed)
+        model.steps = meta['steps']
+        return model
+
+class EnsembleTreeModel:
+    """
+    EnsembleTreeModel runs replicates independent copies of CountTreeModel on the same tree as one (replicates x approaches) array of ant counts.
+    Every step splits the ants of every replicate and approach over its candidate moves with one broadcast multinomial draw, so R replicates cost one array pass
+    instead of R models. ants is the (replicates x nodes) count of every node; state is the shared tree and its own ants are left at zero.
+    """
+    def __init__(self, G, pop, replicates, seed=None, params=None):
+        if not 0 <= pop <= MAX_COUNT:
+            raise ValueError(f'the counts engines run 0 to MAX_COUNT (2**53) ants, not {pop}')
+        self.G = G
+        self.params = dict(parameters, **(params or {}))
+        G.graph['parameters'] = self.params
+        self.state = TreeState(G)
+        self.state.clear() # a reused tree still carries the 'ants' and 'p' of its last run
+        self.rng = np.random.default_rng(seed)
+        self.steps = 0
+        self.probs = self.state.turns(self.params).probabilities()
+        self.moving = ~self.state.nest[self.state.approach_node]
+
+        self.counts = np.zeros((replicates, len(self.state.approach_node)), dtype=np.int64) # ants per replicate and approach
+        self.counts[:, self.state.start('O')] = pop
+        self.ants = self._node_counts()
+
+    def _node_counts(self):
+        replicates, approaches = self.counts.shape
+        nodes = len(self.state.names)
+        index = (np.arange(replicates)[:, None] * nodes + self.state.approach_node).ravel()
+        return np.bincount(index, weights=self.counts.ravel(), minlength=replicates * nodes).astype(np.int64).reshape(replicates, nodes)
+
+    def step(self):
+        self.steps += 1
+        rows = np.flatnonzero(self.moving & self.counts.any(axis=0))
+        if len(rows) == 0:
+            return
+
+        replicates, approaches = self.counts.shape
+        split = self.rng.multinomial(self.counts[:, rows], self.probs[rows]) # (replicates x rows x candidates)
+        self.counts[:, rows] = 0
+        index = (np.arange(replicates)[:, None] * approaches + self.state.slot[rows].ravel()).ravel()
+        self.counts += np.bincount(index, weights=split.ravel(), minlength=replicates * approaches).astype(np.int64).reshape(replicates, approaches)
+        self.ants = self._node_counts()
+
+    def absorbed(self):
+        return not self.counts[:, self.moving].any()
 
 ##################################
 #      Analytical Functions      #
 ##################################
 
-def sim(n = 10, ants = 100, data = False):
+def default_tree():
+    """
+    Returns a freshly built copy of the default tree sim() runs on.
+    """
+    return construct_tree(balanced_tree())
+
+def sim(n = 10, ants = 100, data = False, engine = 'mesa', G = None, params = None, seed = None, mode = 'agents', early_stop = False, cache = False):
     """
-    Sim runs a model for n steps on ants ants, and returns either the tree on its own or the data too if specified. The default tree is provided below.
+    Sim runs a model for n steps on ants ants, and returns either the tree on its own or the data too if specified. The default tree is given by default_tree().
+    engine picks the implementation: 'mesa' (TreeModel, one agent at a time) or 'numpy' (VectorTreeModel, whole population per step).
+    G runs on a given tree instead of the default one, params overrides entries of the module-level parameters for this run only, and seed (an int, SeedSequence or Generator) seeds the model's random stream.
+    mode = 'counts' moves ant counts instead of ants (CountTreeModel, any engine is ignored), for populations far too large to simulate one by one.
+    There are no ant positions then, so data is the occupancy frame (steps x nodes) that graph_draw plots, rather than the per-ant positions.
+    early_stop = True stops as soon as every ant has reached a nest, as nothing changes after that; the data then ends with that final state instead of running to n steps.
+    cache = True (or a result_cache.ResultCache) returns a stored copy of a run with the same parameters, tree, arguments, seed (an int or SeedSequence) and model source,
+    and stores the run otherwise, so repeating a call only costs loading its arrays.
     """
+    if G is None:
+        G = default_tree()
+    if cache:
+        full = dict(parameters, **(params or {}))
+        results, key, hit = result_cache.lookup(cache, __name__, G, full, seed, n=n, ants=ants, data=data, engine=engine, mode=mode, early_stop=early_stop)
+        if hit is not None:
+            collector = result_cache.restore(G, full, hit)
+            if data and mode == 'counts':
+                return G, collector.get_occupancy_dataframe()
+            if data:
+                return G, collector.get_agent_vars_dataframe()
+            return G
+    if mode == 'counts':
+        collector = OccupancyCollector(steps=n)
+        model = CountTreeModel(G, ants, seed=seed, datacollector=collector, params=params)
+    elif mode != 'agents':
+        raise ValueError(f"unknown mode {mode!r}, expected 'agents' or 'counts'")
+    else:
+        collector = OccupancyCollector(positions=data, steps=n)
+        if engine == 'numpy':
+            model = VectorTreeModel(G, ants, seed=seed, datacollector=collector, params=params)
+        elif engine == 'mesa':
+            model = TreeModel(G, ants, seed=seed, datacollector=collector, params=params)
+        else:
+            raise ValueError(f"unknown engine {engine!r}, expected 'mesa' or 'numpy'")
 
-    model = TreeModel(construct_tree(balanced_tree(depth=5, weight_map = [0.338,0.253,0.253,0.253,0.338,0.45,0.253,0.338,0.338,0.45,0.6,0.45,0.338,0.45,0.253,0.338,0.338,0.45,0.253,0.338,0.253,0.338,0.253,0.253,0.45,0.6,0.338,0.45,0.338,0.45,0.338,0.253])), ants)
     for i in range(n):
         model.step()
-        
+        if early_stop and i < n-1 and model.absorbed():
+            collector.collect(model) # the final state, which the next step would have collected
+            break
+    model.sync()
+    collector.close()
+    if cache:
+        result_cache.store(results, key, model, collector)
+
+    if data and mode == 'counts':
+        return model.G, collector.get_occupancy_dataframe()
     if data:
         return model.G, model.datacollector.get_agent_vars_dataframe()
 
     return model.G
 
-def experiment(n=50, ants = 1000, relabel=True):
+def ensemble(n = 10, ants = 100, replicates = 100, G = None, params = None, seed = None):
+    """
+    ensemble runs replicates independent runs of n steps on ants ants at once (EnsembleTreeModel), for confidence intervals without a loop over sim() calls.
+    G, params and seed work as in sim; the replicates share the one seeded stream, so the same seed gives the same ensemble.
+    Output: the (replicates x n x nodes) occupancy cube (int32, or int64 past 2**31-1 ants), nodes in G.nodes() order. Every replicate has the distribution of sim(n, ants, mode='counts').
+    """
+    if G is None:
+        G = default_tree()
+    model = EnsembleTreeModel(G, ants, replicates, seed=seed, params=params)
+    cube = np.empty((replicates, n, len(model.state.names)), dtype=count_dtype(ants))
+    for i in range(n):
+        cube[:, i] = model.ants # collected before the step, like the collectors of sim
+        model.step()
+    return cube
+
+def _chain(G, params):
+    """
+    The Markov chain of a single ant: the TreeState of G, the (approaches x max degree) move probabilities the models sample from, and which approaches keep moving (nests absorb).
+    """
+    state = TreeState(default_tree() if G is None else G)
+    probs = state.turns(dict(parameters, **(params or {}))).probabilities()
+    moving = ~state.nest[state.approach_node]
+    return state, probs, moving
+
+def transition_matrix(G=None, params=None):
+    """
+    Inputs: a tree (default_tree() when omitted) and parameter overrides, like sim.
+    Outputs: the sparse (approaches x approaches) transition matrix over directed edges (ppos, pos) built from the same width, left/right and u-turn rules as AgAnt.choice,
+    with every approach onto a nest absorbing, and the TreeState indexing it (state.approach_node / approach_prev give each row's pos / ppos). Needs scipy.
+    """
+    from scipy import sparse
+    state, probs, moving = _chain(G, params)
+    rows, cols, vals = _transitions(state, probs, moving)
+    size = len(state.approach_node)
+    return sparse.csr_matrix((vals, (rows, cols)), shape=(size, size)), state
+
+def _transitions(state, probs, moving):
+    valid = state.valid & moving[:, None]
+    rows = np.concatenate([np.nonzero(valid)[0], np.flatnonzero(~moving)])
+    cols = np.concatenate([state.slot[valid], np.flatnonzero(~moving)])
+    vals = np.concatenate([probs[valid], np.ones((~moving).sum())])
+    return rows, cols, vals
+
+def expected_occupancy(n = 10, ants = 100, G = None, params = None):
+    """
+    Inputs: n steps, ants ants, and optionally a tree and parameter overrides, like sim.
+    Output: the expected number of ants on every node at every step, the mean of the occupancy frame sim(n, ants, data=True, mode='counts') returns, computed exactly with one
+    sparse transition (a scatter-add over the candidate moves) per step instead of by simulation.
+    """
+    import pandas as pd
+    state, probs, moving = _chain(G, params)
+    nodes = len(state.names)
+    x = np.zeros(len(state.approach_node))
+    x[state.start('O')] = ants
+    flow = probs * moving[:, None]
+    occupancy = np.empty((n, nodes))
+    for i in range(n):
+        occupancy[i] = np.bincount(state.approach_node, weights=x, minlength=nodes)
+        x = np.where(moving, 0, x) + np.bincount(state.slot.ravel(), weights=(x[:, None] * flow).ravel(), minlength=len(x))
+
+    frame = pd.DataFrame(occupancy, columns=state.names)
+    frame.index.name = 'Step'
+    return frame
+
+def absorption_probabilities(G = None, params = None):
+    """
+    Inputs: optionally a tree and parameter overrides, like sim.
+    Output: a Series with the probability that an ant leaving 'O' eventually stops at each nest, from one sparse linear solve over the transient approaches,
+    (I - Q)^T y = start, absorption = R^T y. Uses scipy when it is installed and a dense solve otherwise.
+    """
+    import pandas as pd
+    state, probs, moving = _chain(G, params)
+    rows, cols, vals = _transitions(state, probs, moving)
+    transient = np.flatnonzero(moving)
+    absorbing = np.flatnonzero(~moving)
+    size = len(state.approach_node)
+    start = np.zeros(len(transient))
+    start[np.searchsorted(transient, state.start('O'))] = 1
+
+    try:
+        from scipy import sparse
+        from scipy.sparse.linalg import spsolve
+    except ImportError:
+        P = np.zeros((size, size))
+        P[rows, cols] = vals
+        Q = P[np.ix_(transient, transient)]
+        R = P[np.ix_(transient, absorbing)]
+        y = np.linalg.solve((np.eye(len(transient)) - Q).T, start)
+    else:
+        P = sparse.csr_matrix((vals, (rows, cols)), shape=(size, size))
+        Q = P[transient][:, transient]
+        R = P[transient][:, absorbing]
+        y = spsolve(sparse.csc_matrix((sparse.identity(len(transient)) - Q).T), start)
+    absorbed = R.T @ y
+
+    nests = np.flatnonzero(state.nest)
+    per_node = np.bincount(state.approach_node[absorbing], weights=absorbed, minlength=len(state.names))
+    return pd.Series(per_node[nests], index=[state.names[i] for i in nests], name='absorption')
+
+def experiment(n=50, ants = 1000, relabel=True, seed=None, cache=False):
     """
     experiment simply calls sim then draws the graphs. relabel true means clockwise labels, false means lab labels.
+    seed and cache are passed to sim, so experiment(50, 1000, seed=1, cache=True) only simulates the first time.
     Sample run: experiment(50,1000)
     """
-    G,data = sim(n,ants,True)
+    G,data = sim(n,ants,True,seed=seed,cache=cache)
     graph_draw(G,data,relabel)
+
+def animate(path, n = 200, ants = 1000, engine = 'numpy', G = None, params = None, seed = None, **options):
+    """
+    animate runs a model for n steps like sim (engine 'numpy', 'mesa' or 'counts' for CountTreeModel) and renders the ants on every node at every step to path,
+    a directory of frames, a .gif or a video, without a display. options go to frames.render (every, fps, workers, layout, size, ...).
+    Output: the number of frames written. Sample run: animate('individual.gif', 200, 1000)
+    """
+    if G is None:
+        G = default_tree()
+    collector = OccupancyCollector(steps=n)
+    if engine == 'numpy':
+        model = VectorTreeModel(G, ants, seed=seed, datacollector=collector, params=params)
+    elif engine == 'mesa':
+        model = TreeModel(G, ants, seed=seed, datacollector=collector, params=params)
+    elif engine == 'counts':
+        model = CountTreeModel(G, ants, seed=seed, datacollector=collector, params=params)
+    else:
+        raise ValueError(f"unknown engine {engine!r}, expected 'mesa', 'numpy' or 'counts'")
+    for i in range(n):
+        model.step()
+    collector.close()
+    return render(G, collector.occupancy(), path, node_color=node_colors(G), **options)
@@ -0,0 +1,228 @@
+"""
+Benchmark suite for sim() of both models.
+
+Every case (model, engine, tree depth, ants, steps) runs in a fresh python process so its peak RSS is its own, and reports
+steps/sec, ant-steps/sec, the time spent building the tree and the model, and the peak resident memory. Results are saved as JSON
+so runs can be compared over time (--compare) and across engines.
+
+--startup guards the import cost of the model modules instead: each is imported in a fresh process, which has to stay under --startup-limit seconds
+and must not load any of the plotting stack (HEAVY), so headless sweep workers never pay for it. It exits with status 1 when the guard fails.
+
+Sample runs:
+    python benchmark.py --quick
+    python benchmark.py --models individual --engines numpy --ants 100 1000000 --depths 3 12 --steps 100 -o results.json
+    python benchmark.py --quick -o new.json --compare old.json
+    python benchmark.py --startup
+"""
+import argparse
+import datetime
+import importlib
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+MODELS = {'individual' : 'MesAntIndividual', 'colony' : 'MesAntColony'}
+
+# Modules that importing a model must not load: drawing and image libraries are imported by graph_draw/animate when they run.
+# pandas is not listed, mesa imports it itself.
+HEAVY = ('matplotlib', 'pylab', 'pygraphviz', 'PIL', 'scipy')
+
+##################################
+#          Single Case           #
+##################################
+
+def build_tree(module, depth):
+    """
+    The default widths (and tip types) repeated around a balanced tree of the given depth.
+    """
+    return module.construct_tree(module.balanced_tree(depth=depth))
+
+def peak_rss():
+    """
+    Peak resident set size of this process in bytes (ru_maxrss is in kilobytes on Linux and bytes on macOS).
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def run_case(case):
+    """
+    Times one case in this process: tree construction, model construction and n steps, using the same models sim() runs.
+    """
+    from occupancy import OccupancyCollector
+    module = importlib.import_module(MODELS[case['model']])
+
+    start = time.perf_counter()
+    G = build_tree(module, case['depth'])
+    built = time.perf_counter()
+    collector = OccupancyCollector(steps=case['steps'])
+    if case['engine'] == 'numpy':
+        model = module.VectorTreeModel(G, case['ants'], seed=case['seed'], datacollector=collector)
+    else:
+        model = module.TreeModel(G, case['ants'], seed=case['seed'], datacollector=collector)
+    ready = time.perf_counter()
+    for i in range(case['steps']):
+        model.step()
+    done = time.perf_counter()
+
+    seconds = done - ready
+    return dict(case,
+        status = 'ok',
+        nodes = len(G),
+        tree_seconds = built - start,
+        setup_seconds = ready - built,
+        step_seconds = seconds,
+        steps_per_sec = case['steps'] / seconds if seconds else None,
+        ant_steps_per_sec = case['steps'] * case['ants'] / seconds if seconds else None,
+        peak_rss_bytes = peak_rss(),
+    )
+
+
+def import_case(model):
+    """
+    Times importing one model module in this (fresh) process and lists the HEAVY modules it loaded.
+    """
+    start = time.perf_counter()
+    importlib.import_module(MODELS[model])
+    seconds = time.perf_counter() - start
+    return {'model' : model, 'import_seconds' : seconds, 'heavy' : sorted(name for name in HEAVY if name in sys.modules)}
+
+
+##################################
+#             Suite              #
+##################################
+
+def run_suite(models, engines, ants, depths, steps, seed=0, timeout=600):
+    """
+    Runs every combination in a subprocess. Within one (model, engine, depth, steps) series ant counts run from small to large,
+    and once a case fails or runs past timeout seconds the larger ones are recorded as skipped.
+    """
+    results = []
+    for model, engine, depth, n in itertools.product(models, engines, depths, steps):
+        failed = None
+        for pop in sorted(ants):
+            case = dict(model=model, engine=engine, depth=depth, ants=pop, steps=n, seed=seed)
+            if failed is not None:
+                results.append(dict(case, status='skipped', reason=f'{failed} at fewer ants'))
+                continue
+            try:
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+                    capture_output=True, text=True, timeout=timeout, cwd=os.path.dirname(os.path.abspath(__file__)))
+            except subprocess.TimeoutExpired:
+                failed = 'timeout'
+                results.append(dict(case, status='timeout', reason=f'over {timeout}s'))
+            else:
+                if out.returncode != 0:
+                    failed = 'error'
+                    results.append(dict(case, status='error', reason=out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f'exit {out.returncode}'))
+                else:
+                    results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            report(results[-1])
+    return results
+
+def run_startup(models, limit=2.0):
+    """
+    Imports every model module in a fresh process. A model passes when the import took at most limit seconds and loaded no HEAVY module.
+    """
+    results = []
+    for model in models:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--import', model],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if out.returncode != 0:
+            result = {'model' : model, 'status' : 'error', 'reason' : out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f'exit {out.returncode}'}
+        else:
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            reasons = ([f"over {limit}s"] if result['import_seconds'] > limit else []) + [f'loads {name}' for name in result['heavy']]
+            result['status'] = 'failed' if reasons else 'ok'
+            if reasons:
+                result['reason'] = ', '.join(reasons)
+        print(f"{model:>10} import {result['status']}" + (f" {result['import_seconds']:.3f}s" if 'import_seconds' in result else '') + (f": {result['reason']}" if 'reason' in result else ''), flush=True)
+        results.append(result)
+    return results
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    import numpy, networkx, mesa
+    return {
+        'timestamp' : datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit' : commit,
+        'python' : platform.python_version(),
+        'numpy' : numpy.__version__,
+        'networkx' : networkx.__version__,
+        'mesa' : mesa.__version__,
+        'platform' : platform.platform(),
+        'cpus' : os.cpu_count(),
+    }
+
+def key(result):
+    return tuple(result[name] for name in ('model', 'engine', 'depth', 'ants', 'steps'))
+
+def report(result):
+    name = '{model:>10} {engine:>5} depth={depth:<2} ants={ants:<8} steps={steps:<5}'.format(**result)
+    if result['status'] != 'ok':
+        print(f"{name} {result['status']}: {result.get('reason', '')}", flush=True)
+    else:
+        print(f"{name} {result['steps_per_sec']:>12.1f} steps/s {result['ant_steps_per_sec']:>14.0f} ant-steps/s {result['peak_rss_bytes']/2**20:>9.1f} MiB", flush=True)
+
+def compare(results, baseline):
+    """
+    Prints the ant-steps/sec speedup of every case that also ran successfully in the baseline results.
+    """
+    before = {key(result): result for result in baseline if result['status'] == 'ok'}
+    for result in results:
+        old = before.get(key(result))
+        if result['status'] == 'ok' and old is not None:
+            name = '{model:>10} {engine:>5} depth={depth:<2} ants={ants:<8} steps={steps:<5}'.format(**result)
+            print(f"{name} {result['ant_steps_per_sec'] / old['ant_steps_per_sec']:>7.2f}x  rss {result['peak_rss_bytes'] / old['peak_rss_bytes']:>5.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark sim() of MesAntIndividual and MesAntColony.')
+    parser.add_argument('--models', nargs='+', default=list(MODELS), choices=list(MODELS))
+    parser.add_argument('--engines', nargs='+', default=['mesa', 'numpy'], choices=['mesa', 'numpy'])
+    parser.add_argument('--ants', nargs='+', type=int, default=[100, 1000, 10000, 100000, 1000000])
+    parser.add_argument('--depths', nargs='+', type=int, default=[3, 6, 9, 12])
+    parser.add_argument('--steps', nargs='+', type=int, default=[10, 100, 1000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600, help='seconds per case before the larger ones in its series are skipped')
+    parser.add_argument('--quick', action='store_true', help='a small grid for checking a change in a minute or two')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='where to save the JSON results')
+    parser.add_argument('--compare', help='a previous JSON results file to print speedups against')
+    parser.add_argument('--startup', action='store_true', help='only check the import time of the models and that they load no plotting libraries')
+    parser.add_argument('--startup-limit', type=float, default=2.0, help='seconds a model import may take with --startup')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--import', dest='import_model', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+    if args.import_model:
+        print(json.dumps(import_case(args.import_model)))
+        return
+    if args.startup:
+        startup = run_startup(args.models, args.startup_limit)
+        sys.exit(0 if all(result['status'] == 'ok' for result in startup) else 1)
+
+    if args.quick:
+        args.ants, args.depths, args.steps, args.timeout = [100, 10000], [3, 6], [100], 120
+    startup = run_startup(args.models, args.startup_limit)
+    results = run_suite(args.models, args.engines, args.ants, args.depths, args.steps, args.seed, args.timeout)
+    with open(args.output, 'w') as file:
+        json.dump({'meta' : metadata(), 'startup' : startup, 'results' : results}, file, indent=2)
+    print(f'saved {len(results)} results to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import os
+
+##################################
+#           Cache Files          #
+##################################
+# Every file this package writes for later reads (parsed csvs, layouts, cached runs, checkpoints) is written to a temporary file next to its path
+# and then renamed over it, so readers in other processes (sweep workers, parallel sessions) never see half a file.
+
+def atomic_write(path, write, mode='wb'):
+    """
+    Calls write(file) on a temporary file next to path and then replaces path with it in one step. write gets a file object, which also keeps
+    numpy's save functions from appending .npy/.npz to the name. Missing directories are created; on an error the temporary file is removed and the error raised.
+    """
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(tmp, mode) as file:
+            write(file)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def write_cache(path, write, mode='wb'):
+    """
+    atomic_write for caches: returns whether path was written, since an unwritable cache only costs the next reader a recompute.
+    """
+    try:
+        atomic_write(path, write, mode)
+    except OSError:
+        return False
+    return True
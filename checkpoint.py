@@ -0,0 +1,83 @@
+import hashlib
+import json
+import numpy as np
+from cachefile import atomic_write
+from seeding import ModelRandom
+
+##################################
+#          Checkpoints           #
+##################################
+# A checkpoint is one compressed .npz of plain arrays: the TreeState's node ants and edge pheromone (with the lazy decay clock), the pheromone TurnTable,
+# the model's per-ant or per-approach arrays, and a JSON 'meta' entry holding the model class, its parameters, the step, the tree signature and the Generator state.
+
+def signature(state):
+    """
+    Returns a hash of a TreeState's node names and adjacency, so a checkpoint is only ever restored onto the tree it was saved from.
+    """
+    digest = hashlib.sha1('\0'.join(map(str, state.names)).encode())
+    digest.update(state.indptr.tobytes())
+    digest.update(state.indices.tobytes())
+    return digest.hexdigest()
+
+def save(path, model, steps, **arrays):
+    """
+    Writes the state shared by every model plus the model's own arrays to path.
+    """
+    state = model.state
+    meta = {
+        'model' : type(model).__module__ + '.' + type(model).__qualname__,
+        'params' : model.params,
+        'steps' : steps,
+        'tree' : signature(state),
+        'rng' : model.rng.bit_generator.state,
+        'clock' : state.clock,
+        'decay' : [state.decay_rate, state.decay_amount, state.lazy],
+    }
+    if isinstance(getattr(model, 'random', None), ModelRandom):
+        arrays['draws'] = np.array(model.random._draws[model.random._next:], dtype=float) # buffered draws not used yet
+    turns = getattr(model, 'turns', None)
+    if turns is not None and turns.pheromone:
+        arrays.update(cum=turns.cum, stale=turns.stale, compiled=turns.compiled)
+    meta = np.array(json.dumps(meta, default=lambda value: value.item()))
+    atomic_write(path, lambda file: np.savez_compressed(file, meta=meta, ants=state.ants, p=state.p, settled=state.settled, **arrays))
+
+def load(path, cls):
+    """
+    Reads a checkpoint saved by a cls model (restore checks the tree).
+    Outputs: meta (a dict) and the arrays, for the model's load_checkpoint to rebuild itself from.
+    """
+    with np.load(path) as file:
+        arrays = {key: file[key] for key in file.files}
+    meta = json.loads(str(arrays.pop('meta')))
+    name = cls.__module__ + '.' + cls.__qualname__
+    if meta['model'] != name:
+        raise ValueError(f"{path} holds a {meta['model']} checkpoint, not a {name} one")
+    return meta, arrays
+
+def restore(model, meta, arrays, seed=None):
+    """
+    Puts the shared state of a checkpoint back onto a freshly built model (after checking the tree), leaving the per-ant arrays to the model.
+    With a seed, the model's Generator (and the ModelRandom drawing from it) continue from that seed instead of the saved stream, which forks the run.
+    """
+    state = model.state
+    if signature(state) != meta['tree']:
+        raise ValueError('the checkpoint was saved on a different tree, pass the tree it was run on as G')
+    state.ants[:] = arrays['ants']
+    state.p[:] = arrays['p']
+    state.settled[:] = arrays['settled']
+    state.clock = meta['clock']
+    state.decay_rate, state.decay_amount, state.lazy = meta['decay']
+    if seed is None:
+        model.rng.bit_generator.state = meta['rng']
+        if 'draws' in arrays:
+            model.random._draws = arrays['draws'].tolist()
+            model.random._next = 0
+    else:
+        model.rng.bit_generator.state = np.random.default_rng(seed).bit_generator.state # in place, so everything holding model.rng follows
+        if isinstance(getattr(model, 'random', None), ModelRandom):
+            model.random._draws = [] # none of the saved stream's buffered draws
+            model.random._next = 0
+    if 'cum' in arrays:
+        model.turns.cum[:] = arrays['cum']
+        model.turns.stale[:] = arrays['stale']
+        model.turns.compiled[:] = arrays['compiled']
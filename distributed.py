@@ -0,0 +1,312 @@
+import math
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+from threading import BrokenBarrierError
+import numpy as np
+from tree_state import TreeState, TurnTable, choose, arrive_table
+from occupancy import count_dtype
+import MesAntColony
+from MesAntColony import States, ARRIVE, advance, parameters
+
+##################################
+#          Partitioning          #
+##################################
+# The tree is cut into subtrees of about equal size and the subtrees are dealt out to the workers, so every node has one owner.
+# An edge belongs to the owner of its lower (child) end, so an ant crossing between two workers always moves along an edge owned by one of them.
+
+def levels(state, root='O'):
+    """
+    Breadth first levels of the tree from root, as arrays of node ids, and the parent id of every node (-1 for root).
+    """
+    parent = np.full(len(state.names), -1, dtype=np.int64)
+    seen = np.zeros(len(state.names), dtype=bool)
+    frontier = np.array([state.index[root]], dtype=np.int64)
+    seen[frontier] = True
+    found = []
+    while len(frontier):
+        found.append(frontier)
+        starts, ends = state.indptr[frontier], state.indptr[frontier + 1]
+        counts = ends - starts
+        owners = np.repeat(frontier, counts)
+        neighbors = state.indices[np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+        new = ~seen[neighbors]
+        frontier = neighbors[new]
+        parent[frontier] = owners[new]
+        seen[frontier] = True
+    return found, parent
+
+def partition(state, workers, root='O'):
+    """
+    Inputs: a TreeState and the number of workers.
+    Outputs: the worker owning each node, and the parent of each node. Walking up from the tips, a subtree is cut off as a part once it holds nodes/(4*workers) nodes
+    not already cut, and the parts (about four per worker) are dealt to the workers largest first onto the least loaded one.
+    """
+    found, parent = levels(state, root)
+    nodes = len(state.names)
+    target = max(1, math.ceil(nodes / (4 * workers)))
+    remaining = np.ones(nodes, dtype=np.int64)
+    cut = np.zeros(nodes, dtype=bool)
+    for level in reversed(found[1:]):
+        cut[level[remaining[level] >= target]] = True
+        np.add.at(remaining, parent[level], np.where(cut[level], 0, remaining[level]))
+    cut[found[0]] = True
+
+    roots = np.flatnonzero(cut)
+    load = np.zeros(workers, dtype=np.int64)
+    owner_of_root = {}
+    for i in np.argsort(-remaining[roots], kind='stable'):
+        w = int(np.argmin(load))
+        owner_of_root[roots[i]] = w
+        load[w] += remaining[roots[i]]
+
+    owner = np.empty(nodes, dtype=np.int64)
+    for level in found:
+        owner[level] = owner[parent[level]] # the root's garbage entry is overwritten just below
+        for node in level[cut[level]]:
+            owner[node] = owner_of_root[node]
+    return owner, parent
+
+def halo(state, owner, edge_owner, worker):
+    """
+    The part of the tree one worker holds: the TreeState.subtree of its nodes and of their neighbors (the halo, the other workers' nodes its ants can step onto),
+    with the owner of each of its nodes and edges. A worker's memory and work per step follow the size of its part, not of the tree.
+    """
+    tails = state.approach_prev[:len(state.indices)]
+    sub = state.subtree(np.union1d(np.flatnonzero(owner == worker), state.indices[owner[tails] == worker]))
+    return sub, owner[sub.nodes], edge_owner[sub.edge_ids]
+
+
+##################################
+#         Shared Memory          #
+##################################
+
+class _Shared:
+    """
+    Named shared memory arrays created by the parent process and attached by the workers.
+    """
+    def __init__(self):
+        self.blocks = []
+        self.specs = {}
+
+    def create(self, name, shape, dtype):
+        dtype = np.dtype(dtype)
+        block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self.blocks.append(block)
+        self.specs[name] = (block.name, shape, dtype.str)
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        array[...] = 0
+        return array
+
+    def close(self):
+        for block in self.blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass # an array of an interrupted run still points into it, the memory goes with the process
+            block.unlink()
+
+def _attach(specs):
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return blocks, arrays
+
+
+##################################
+#            Workers             #
+##################################
+
+def _worker(me, state, owner, edge_owner, params, pop, n, seed, specs, barrier, record):
+    blocks, shared = _attach(specs)
+    try:
+        _simulate(me, state, owner, edge_owner, params, pop, n, seed, shared, barrier, record)
+    except BrokenBarrierError:
+        pass # another worker failed or a wait timed out, sim reports it
+    except BaseException:
+        barrier.abort() # release the workers waiting on this one
+        raise
+    finally:
+        del shared
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass
+
+def _simulate(me, state, owner, edge_owner, params, pop, n, seed, shared, barrier, record):
+    """
+    One worker's part of every step: the VectorTreeModel step kernel (advance) for the ants on its nodes, then an exchange of the ants that crossed onto other workers' nodes.
+    state is the worker's halo TreeState and owner / edge_owner the owners of its nodes and edges; ants cross between workers as approach ids of the whole tree (state.approach_ids).
+    p is double buffered (read p[step % 2], write p[(step + 1) % 2]), so the only waits are one barrier after the outboxes are written and one after the pheromone is.
+    An outbox holds a fixed number of ants; a step in which some worker hands over more takes extra rounds of two barriers each, one outbox's worth per round.
+    """
+    rng = np.random.default_rng(seed)
+    nodes = len(state.names)
+    turns = TurnTable(state, params)
+    mine = np.flatnonzero(owner == me)
+    my_edges = np.flatnonzero(edge_owner == me)
+    rows = np.flatnonzero(owner[state.approach_node] == me) # approaches of ants standing on this worker's nodes
+    arrive = arrive_table(state, ARRIVE)
+
+    local = pop if 'O' in state.index and owner[state.index['O']] == me else 0
+    approach = np.full(local, state.start('O') if local else 0, dtype=np.int64)
+    status = np.full(local, States.WAITING_HOME.value, dtype=np.uint8)
+    ants = np.zeros(nodes, dtype=np.int64)
+    if local:
+        ants[state.index['O']] = local
+    delta = np.zeros(len(state.p))
+
+    boxes = [shared[name][me] for name in ('out_dest', 'out_approach', 'out_status', 'out_deposit')]
+    capacity = len(boxes[0])
+    nothing = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=bool))
+
+    def post(sending, exchange):
+        # one outbox's worth of this step's crossing ants (destination, approach, status, deposit) for the given exchange round
+        part = slice(exchange * capacity, (exchange + 1) * capacity)
+        for box, values in zip(boxes, sending):
+            box[:len(values[part])] = values[part]
+
+    for step in range(n):
+        if record:
+            shared['occupancy'][step, state.nodes[mine]] = ants[mine]
+        p = shared['p'][step % 2][state.edge_ids] # the pheromone of this worker's edges at the start of the step
+        delta[:] = 0
+
+        def sample(movers, before, draws):
+            cum = turns.cumulative(p, rows) # the turn table of this worker's approaches
+            return state.first[before] + choose(cum, np.searchsorted(rows, before), draws)
+
+        moves = advance(state, approach, status, ants[state.approach_node[approach]], arrive, params['leave_home'], rng, sample)
+        gone = np.zeros(len(approach), dtype=bool)
+        sending = nothing
+        if len(moves.movers):
+            edge = state.edge[moves.moved]
+            returning = moves.returning
+            np.add.at(delta, edge[returning & (edge_owner[edge] == me)], params['padd'])
+
+            after = state.approach_node[moves.moved]
+            ants -= np.bincount(state.approach_node[moves.before], minlength=nodes)
+            crossing = owner[after] != me
+            ants += np.bincount(after[~crossing], minlength=nodes)
+            out = moves.movers[crossing]
+            deposit = returning[crossing] & (edge_owner[edge[crossing]] != me) # the receiver owns that edge
+            sending = owner[after[crossing]], state.approach_ids[approach[out]], status[out], deposit
+            gone[out] = True
+        shared['out_count'][me, 0] = len(sending[0])
+        post(sending, 0)
+        barrier.wait()
+
+        # Ants that crossed onto this worker's nodes, and the deposits on its edges they made doing so
+        incoming = [approach[~gone]], [status[~gone]]
+        counts = shared['out_count'][:, 0].copy()
+        for exchange in range(max(1, -(-int(counts.max()) // capacity))):
+            if exchange:
+                barrier.wait() # every worker has read the previous round
+                post(sending, exchange)
+                barrier.wait()
+            for other in range(len(counts)):
+                k = min(max(counts[other] - exchange * capacity, 0), capacity)
+                if other == me or k == 0:
+                    continue
+                to_me = np.flatnonzero(shared['out_dest'][other, :k] == me)
+                if len(to_me):
+                    arriving = np.searchsorted(state.approach_ids, shared['out_approach'][other, to_me]) # onto this worker's nodes, so always in its halo
+                    incoming[0].append(arriving)
+                    incoming[1].append(shared['out_status'][other, to_me])
+                    ants += np.bincount(state.approach_node[arriving], minlength=nodes)
+                    np.add.at(delta, state.edge[arriving[shared['out_deposit'][other, to_me]]], params['padd'])
+        approach = np.concatenate(incoming[0])
+        status = np.concatenate(incoming[1])
+
+        shared['p'][(step + 1) % 2, state.edge_ids[my_edges]] = np.maximum((p[my_edges] + delta[my_edges]) * (1 - params['pdecay_rate']) + params['pdecay'], 0)
+        barrier.wait()
+
+    shared['ants'][state.nodes[mine]] = ants[mine]
+
+
+##################################
+#         Distributed Run        #
+##################################
+
+def sim(n = 10, ants = 100, workers = 4, data = False, G = None, params = None, seed = None, outbox = None, timeout = 600):
+    """
+    Runs the colony model for n steps on ants ants across workers processes, each owning the ants and the edge pheromone of its part of the tree (partition) and holding only that part and its halo.
+    Every step each worker advances its ants with the step kernel VectorTreeModel.step uses (MesAntColony.advance), writes the ants that moved onto another worker's nodes to its outbox in shared memory,
+    and after a barrier picks up the ants addressed to it, so runs have the distribution of sim(n, ants, engine='numpy') of MesAntColony on any number of workers.
+    The workers draw from streams spawned from seed, so a seed and a worker count give the same run. outbox is the number of ants a worker hands over per exchange round
+    (ants/(4*workers), at least 1024, by default); a step in which a worker sends more takes extra rounds, so the shared memory stays about outbox*workers*14 bytes.
+    A worker that fails, is killed or waits more than timeout seconds at a barrier stops the run with a RuntimeError.
+    Output: the tree with its final ants and p (like MesAntColony.sim), and with data=True the (steps x nodes) occupancy frame too.
+    """
+    if G is None:
+        G = MesAntColony.default_tree()
+    full = dict(parameters, **(params or {}))
+    G.graph['parameters'] = full
+    state = TreeState(G)
+    state.clear() # a reused tree still carries the 'ants' and 'p' of its last run
+    owner, parent = partition(state, workers)
+    u, v = state.approach_prev[:len(state.indices)], state.indices # every half-edge u -> v
+    child = np.where(parent[v] == u, v, u)
+    edge_owner = np.empty(len(state.p), dtype=np.int64)
+    edge_owner[state.edge] = owner[child]
+
+    shared = _Shared()
+    procs = []
+    try:
+        p = shared.create('p', (2, len(state.p)), np.float64)
+        p[0] = state.p
+        final = shared.create('ants', (len(state.names),), np.int64)
+        occupancy = shared.create('occupancy', (n if data else 1, len(state.names)), count_dtype(ants))
+        shared.create('out_count', (workers, 1), np.int64)
+        if outbox is None:
+            outbox = max(1024, math.ceil(ants / (4 * workers)))
+        capacity = max(1, min(outbox, ants))
+        shared.create('out_dest', (workers, capacity), np.int32)
+        shared.create('out_approach', (workers, capacity), np.int64)
+        shared.create('out_status', (workers, capacity), np.uint8)
+        shared.create('out_deposit', (workers, capacity), bool)
+
+        barrier = mp.Barrier(workers, timeout=timeout) # the default timeout of every wait()
+        root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        seeds = root.spawn(workers) # one independent stream per worker
+        procs = [mp.Process(target=_worker, args=(w, *halo(state, owner, edge_owner, w), full, ants, n, seeds[w], shared.specs, barrier, data)) for w in range(workers)]
+        for proc in procs:
+            proc.start()
+        running = {proc.sentinel: w for w, proc in enumerate(procs)}
+        failed = None
+        while running:
+            for sentinel in wait(list(running)):
+                w = running.pop(sentinel)
+                procs[w].join()
+                if procs[w].exitcode != 0 and failed is None:
+                    failed = w, procs[w].exitcode
+                    # a worker killed inside a barrier wait (SIGKILL, out of memory) can leave the barrier's lock held, so even abort() could hang: stop the others outright
+                    for other in running.values():
+                        procs[other].terminate()
+        if failed:
+            raise RuntimeError(f'distributed worker {failed[0]} failed (exit code {failed[1]}), the run was stopped')
+        if barrier.broken:
+            raise RuntimeError(f'a distributed worker waited more than {timeout} s at a barrier, the run was stopped')
+
+        state.ants[:] = final
+        state.p[:] = p[n % 2]
+        frame = occupancy.copy() if data else None
+        del p, final, occupancy
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+        shared.close()
+
+    G.graph['state'] = state
+    state.sync(G)
+    if data:
+        import pandas as pd
+        frame = pd.DataFrame(frame, columns=state.names)
+        frame.index.name = 'Step'
+        return G, frame
+    return G
@@ -0,0 +1,120 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from layout import tree_layout
+
+##################################
+#        Frame Rendering         #
+##################################
+# Renders the steps of a run (the occupancy rows of an OccupancyCollector and, for the colony, its pheromone rows) as frames of the tree, headless.
+# Every worker draws on one Agg figure of its own: the static part (axes, limits) is rendered once and kept as a background, and each frame only
+# restores it, updates the sizes/colors of the node and edge artists in place and redraws those. Workers take contiguous blocks of steps, so frames are written in parallel.
+
+VIDEO = ('.mp4', '.m4v', '.mov', '.avi', '.mkv', '.webm')
+
+
+def scene(G, node_color=None, layout='auto'):
+    """
+    The static geometry of G: node positions (in G.nodes() order, the order of the occupancy columns), edge segments and base widths (in G.edges() order, the order of the pheromone columns) and node colors.
+    """
+    pos = tree_layout(G, layout)
+    xy = np.array([pos[node] for node in G], dtype=float)
+    segments = np.array([(pos[u], pos[v]) for u, v in G.edges()], dtype=float).reshape(-1, 2, 2)
+    widths = np.array([d.get('weight', 1) * 5 for _, _, d in G.edges(data=True)], dtype=float)
+    return {'xy' : xy, 'segments' : segments, 'widths' : widths, 'colors' : 'tab:blue' if node_color is None else node_color}
+
+
+def _draw(task):
+    """
+    Writes the frames of one block of steps as frame_<index>.png into folder.
+    """
+    geometry, first, counts, pheromone, steps, folder, options = task
+    from matplotlib import colormaps
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+    from PIL import Image
+
+    fig = Figure(figsize=options['figsize'], dpi=options['dpi'])
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes((0, 0, 1, 0.94))
+    ax.set_axis_off()
+    xy, widths = geometry['xy'], geometry['widths']
+    lines = ax.add_collection(LineCollection(geometry['segments'], linewidths=widths, colors='lightgrey', zorder=1, animated=True))
+    dots = ax.scatter(xy[:, 0], xy[:, 1], s=20, c=geometry['colors'], zorder=2, animated=True)
+    margin = 0.08 * np.ptp(xy, axis=0).max()
+    ax.set_xlim(xy[:, 0].max() + margin, xy[:, 0].min() - margin) # inverted like graph_draw
+    ax.set_ylim(xy[:, 1].min() - margin, xy[:, 1].max() + margin)
+    ax.set_aspect('equal')
+    title = fig.text(0.5, 0.97, '', ha='center', va='center', animated=True)
+    cmap = colormaps[options['cmap']]
+
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    for k in range(len(counts)):
+        canvas.restore_region(background)
+        if pheromone is not None:
+            level = pheromone[k] / options['pmax']
+            lines.set_color(cmap(level))
+            lines.set_linewidths(widths * (0.3 + level))
+        dots.set_sizes(counts[k] * options['size'] + 20) # the node sizes of graph_draw
+        title.set_text(f'step {steps[k]}')
+        ax.draw_artist(lines)
+        ax.draw_artist(dots)
+        fig.draw_artist(title)
+        frame = Image.frombuffer('RGBA', canvas.get_width_height(), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1) # the canvas memory itself, no copy
+        frame.save(os.path.join(folder, f'frame_{first + k:05d}.png'), compress_level=1)
+    return len(counts)
+
+
+def render(G, occupancy, path, pheromone=None, node_color=None, every=1, fps=20, workers=None, layout='auto', figsize=(8, 8), dpi=80, size=10, cmap='YlOrBr'):
+    """
+    Inputs: G, the tree the run was on, occupancy, its (steps x nodes) ant counts (OccupancyCollector.occupancy(), columns in G.nodes() order) and optionally pheromone,
+    the (steps x edges) pheromone (OccupancyCollector(pheromone=True).pheromone_history()), which colors and widens the edges relative to the largest value of the run.
+    path is a directory (one frame_00000.png ... per rendered step), a .gif (needs only Pillow) or a video such as .mp4 (needs ffmpeg on the PATH).
+    every renders every k-th step, node_color takes the colors of the model's graph_draw (node_colors(G)), size is the node area per ant, and workers=1 renders in this process.
+    Output: the number of frames written.
+    """
+    occupancy = np.asarray(occupancy)
+    steps = np.arange(0, len(occupancy), every)
+    counts = occupancy[steps]
+    if pheromone is not None:
+        pheromone = np.asarray(pheromone)[steps]
+    peak = float(pheromone.max()) if pheromone is not None and pheromone.size else 0.0
+    options = dict(figsize=figsize, dpi=dpi, size=size, cmap=cmap, pmax=peak if peak > 0 else 1.0)
+    geometry = scene(G, node_color, layout)
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext in VIDEO and shutil.which('ffmpeg') is None:
+        raise ValueError(f'writing {path} needs ffmpeg on the PATH, save a .gif or a directory of frames instead')
+    if ext in VIDEO or ext == '.gif':
+        folder = tempfile.mkdtemp(prefix='frames-')
+    else:
+        folder = path
+        os.makedirs(folder, exist_ok=True)
+
+    try:
+        workers = workers or os.cpu_count()
+        blocks = np.array_split(np.arange(len(steps)), max(1, min(workers, len(steps))))
+        tasks = [(geometry, block[0], counts[block], None if pheromone is None else pheromone[block], steps[block], folder, options) for block in blocks if len(block)]
+        if workers == 1:
+            written = sum(map(_draw, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                written = sum(pool.map(_draw, tasks))
+
+        if ext == '.gif':
+            from PIL import Image
+            images = (Image.open(os.path.join(folder, f'frame_{i:05d}.png')) for i in range(written))
+            first = next(images)
+            first.save(path, save_all=True, append_images=images, duration=1000 / fps, loop=0)
+        elif ext in VIDEO:
+            subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-framerate', str(fps), '-i', os.path.join(folder, 'frame_%05d.png'),
+                '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', path], check=True)
+    finally:
+        if folder != path:
+            shutil.rmtree(folder, ignore_errors=True)
+    return written
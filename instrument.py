@@ -0,0 +1,70 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+##################################
+#         Instrumentation        #
+##################################
+# Models hold a probe: NULL_PROBE (the default) does nothing, so the hooks left in step() and AgAnt.move cost next to nothing,
+# while Probe (instrument=True) records, for every step, the wall time of each phase, event counters and the memory held by the collector.
+
+class NullProbe:
+    """
+    The disabled probe: every hook is a no-op. Hooks that would need extra work to compute their counts check probe.enabled first.
+    """
+    enabled = False
+    _phase = nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, k=1):
+        pass
+
+    def end_step(self, model):
+        pass
+
+    def report(self):
+        raise ValueError('the model was not instrumented, create it with instrument=True')
+
+NULL_PROBE = NullProbe()
+
+
+class Probe:
+    """
+    Probe records one row per step: '<phase>_seconds' for every timed phase (collect, schedule, decay, ...), the counters bumped during the step
+    (moves, uturns, deposits, transitions, ...) and collector_bytes, the memory the datacollector holds after the step.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.rows = []
+        self._row = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            key = name + '_seconds'
+            self._row[key] = self._row.get(key, 0.0) + time.perf_counter() - start
+
+    def count(self, name, k=1):
+        self._row[name] = self._row.get(name, 0) + k
+
+    def end_step(self, model):
+        nbytes = getattr(model.datacollector, 'nbytes', None)
+        self._row['collector_bytes'] = nbytes() if nbytes is not None else None
+        self.rows.append(self._row)
+        self._row = {}
+
+    def report(self):
+        """
+        Returns the per-step rows as a DataFrame indexed by step (missing counters are 0). frame.sum() totals a run and frame.describe() shows the spread.
+        """
+        import pandas as pd
+        frame = pd.DataFrame(self.rows)
+        counters = [column for column in frame.columns if not column.endswith('_seconds') and column != 'collector_bytes']
+        frame[counters] = frame[counters].fillna(0).astype('int64')
+        frame.index.name = 'Step'
+        return frame
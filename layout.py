@@ -0,0 +1,132 @@
+import hashlib
+import importlib.util
+import json
+import os
+import numpy as np
+from cachefile import write_cache
+
+##################################
+#          Tree Layouts          #
+##################################
+# A tree's layout and its clockwise labels only depend on its topology, so both are computed once per tree and cached by tree_hash:
+# in memory for the life of the process, and the layouts also on disk (CACHE_DIR/layouts) so later sessions and sweep workers skip graphviz entirely.
+
+CACHE_DIR = os.environ.get('MESANT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'mesant'))
+
+# Lab names of the tips of the default tree, keyed by their clockwise labels
+LAB_LABELS = {"C0":'1111',"C1":'1112',"C2":'1121',"C3":'1122','D0':'1211','D1':'1212','D2':'1221','D3':'1222','G0':'2111','G1':'2112','G2':'2121','G3':'2122','H0':'2211','H1':'2212','H2':'2221','H3':'2222','A0':'311','A1':'312','A2':'321','A3':'322','E0':'411','E1':'412','E2':'421','E3':'422','B0':'51','B1':'52','F2':'61','F3':'62','B2':'71','B3':'72','F0':'81','F1':'82'}
+
+_labels = {}
+_tips = {}
+_layouts = {}
+
+
+def tree_hash(G):
+    """
+    Returns a hash of the node names and edges of G, the key of every cached layout and label map (weights and attributes do not change a layout).
+    """
+    digest = hashlib.sha1('\0'.join(sorted(map(str, G))).encode())
+    digest.update('\0'.join(sorted('\1'.join(sorted((str(u), str(v)))) for u, v in G.edges())).encode())
+    return digest.hexdigest()
+
+
+def tip_positions(G):
+    """
+    Returns the clockwise position of every tip (a leaf other than 'O') of a tree named with the LR convention, and the number of positions around the tree:
+    a tip's name read as a binary number (L = 0, R = 1), padded with L to the depth of the deepest tip, so a depth d tree has 2**d positions and 'OLL...L' is 0.
+    """
+    key = tree_hash(G)
+    if key not in _tips:
+        tips = [name for name in G if name != 'O' and G.degree(name) == 1]
+        depth = max((len(name) - 1 for name in tips), default=0)
+        _tips[key] = ({name: int(name[1:].ljust(depth, 'L').replace('L','0').replace('R','1'), 2) for name in tips}, 2**depth)
+    return _tips[key]
+
+
+def _letters(k):
+    """
+    A, B, ... Z, AA, AB, ... for k = 0, 1, ...
+    """
+    letters = ''
+    k += 1
+    while k:
+        k, r = divmod(k - 1, 26)
+        letters = chr(r + 65) + letters
+    return letters
+
+
+def clockwise_labels(G):
+    """
+    Returns the map from LR names to clockwise labels that graph_draw relabels with: the tips 'OLLLLL'... become 'A0', 'A1', ... four to a letter clockwise
+    around the tree (A0 ... H3 on the default depth 5 tree, continuing with AA, AB, ... past Z on deeper ones), and every other node keeps its name.
+    """
+    key = tree_hash(G)
+    if key not in _labels:
+        positions, _ = tip_positions(G)
+        _labels[key] = {name: _letters(k//4) + str(k%4) for name, k in positions.items()}
+    return _labels[key]
+
+
+def radial_layout(G, spacing=100.0):
+    """
+    A pure numpy layout of a tree named with the LR convention: 'O' at the centre, a node of depth k on the circle of radius k*spacing,
+    in the middle of the sector its subtree covers (so siblings split their parent's sector in two, L before R).
+    Output: a dict of node names and (x, y) positions, like graphviz_layout returns.
+    """
+    names = list(G)
+    depth = np.fromiter((len(name) - 1 for name in names), dtype=float, count=len(names))
+    index = np.fromiter((int(name[1:].replace('L','0').replace('R','1') or '0', 2) for name in names), dtype=float, count=len(names))
+    angle = 2*np.pi * (index + 0.5) / 2**depth
+    radius = depth * spacing
+    xy = np.column_stack((radius * np.cos(angle), radius * np.sin(angle)))
+    return dict(zip(names, map(tuple, xy.tolist())))
+
+
+def graphviz_radial(G):
+    """
+    The twopi layout graph_draw has always used. It is run on the bare topology, so the graph's attributes never reach graphviz.
+    """
+    import networkx as nx
+    from networkx.drawing.nx_agraph import graphviz_layout
+    H = nx.Graph()
+    H.add_nodes_from(G)
+    H.add_edges_from(G.edges())
+    return graphviz_layout(H, prog = 'twopi')
+
+
+def has_graphviz():
+    return importlib.util.find_spec('pygraphviz') is not None
+
+
+LAYOUTS = {'graphviz' : graphviz_radial, 'radial' : radial_layout}
+
+def tree_layout(G, method = 'auto', cache_dir = None):
+    """
+    Returns the positions of the nodes of G (keyed by their own names), computing them at most once per tree topology.
+    method is 'graphviz' (twopi, needs pygraphviz), 'radial' (radial_layout) or 'auto', which is graphviz when pygraphviz is installed and radial otherwise.
+    Layouts are kept in memory and in cache_dir (CACHE_DIR/layouts by default, set MESANT_CACHE to move it); cache_dir = False skips the disk.
+    """
+    if method == 'auto':
+        method = 'graphviz' if has_graphviz() else 'radial'
+    if method not in LAYOUTS:
+        raise ValueError(f"unknown layout {method!r}, expected 'auto' or one of {list(LAYOUTS)}")
+    key = (tree_hash(G), method)
+    if key in _layouts:
+        return dict(_layouts[key])
+
+    if cache_dir is None:
+        cache_dir = os.path.join(CACHE_DIR, 'layouts')
+    path = os.path.join(cache_dir, f'{key[0]}-{method}.json') if cache_dir else None
+    pos = None
+    if path and os.path.exists(path):
+        try:
+            with open(path) as file:
+                pos = {name: tuple(xy) for name, xy in json.load(file).items()}
+        except (OSError, ValueError):
+            pos = None # a damaged cache entry is recomputed and rewritten
+    if pos is None:
+        pos = {name: (float(x), float(y)) for name, (x, y) in LAYOUTS[method](G).items()}
+        if path:
+            write_cache(path, lambda file: json.dump(pos, file), mode='w')
+    _layouts[key] = pos
+    return dict(pos)
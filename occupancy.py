@@ -0,0 +1,270 @@
+import numpy as np
+
+##################################
+#           Collector            #
+##################################
+
+class OccupancyCollector:
+    """
+    OccupancyCollector is a compact stand-in for DataCollector(agent_reporters={'Position' : "pos"}). Every collect() records the ant count of each node (one row per step, int32 or int64 as count_dtype picks for the population)
+    and, if positions is True, one small integer node code per ant (int16 while the tree has fewer than 32768 nodes). pheromone=True also records the 'p' of every edge (float32, in G.edges() order).
+    Rows are buffered in chunks of 'chunk' steps and flushed to memory (preallocated when 'steps' is given), to a preallocated .npy file or to a Parquet file when 'path' is set.
+    Only with a path does memory stay bounded by the chunk size however long the run is; in memory every flushed chunk is kept until the data is read. Position codes go next to path as <path>.positions.npy / .parquet, pheromone as <path>.pheromone.npy / .parquet.
+    The collector binds to its model (reading model.state, a TreeState, and model.positions()) when the model is built, so a run of no steps reads back as empty (0 x nodes) data.
+    """
+    def __init__(self, positions=False, steps=None, path=None, chunk=1024, pheromone=False):
+        self.positions = positions
+        self.pheromone = pheromone
+        self.steps = steps
+        self.path = path
+        self.chunk = chunk
+        self.names = None
+
+    def bind(self, model):
+        """
+        Sizes the stores for model's nodes, ants and edges. Only the first call (from the model's constructor, or else the first collect()) binds.
+        """
+        if self.names is not None:
+            return
+        self.names = list(model.state.names)
+        code = np.int16 if len(self.names) <= np.iinfo(np.int16).max else np.int32
+        self._counts = _Store(len(self.names), count_dtype(int(model.state.ants.sum())), self.steps, self.path, self.chunk, self.names)
+        if self.positions:
+            pop = len(model.positions())
+            path = None if self.path is None else _sibling_path(self.path, 'positions')
+            self._positions = _Store(pop, code, self.steps, path, self.chunk, [str(i) for i in range(pop)])
+        if self.pheromone:
+            state = model.state
+            path = None if self.path is None else _sibling_path(self.path, 'pheromone')
+            self.edges = [f'{state.names[u]}-{state.names[v]}' for u, v in _edge_ends(state)]
+            self._pheromone = _Store(len(state.p), np.float32, self.steps, path, self.chunk, self.edges)
+
+    @classmethod
+    def from_arrays(cls, names, occupancy, positions=None):
+        """
+        A closed collector holding data collected before (a cached run), with the same accessors as one filled by a model.
+        """
+        collector = cls(positions=positions is not None)
+        collector.names = list(names)
+        collector._counts = _Loaded(occupancy)
+        if positions is not None:
+            collector._positions = _Loaded(positions)
+        return collector
+
+    def collect(self, model):
+        self.bind(model)
+        self._counts.append(model.state.ants)
+        if self.positions:
+            self._positions.append(model.positions())
+        if self.pheromone:
+            model.state.settle() # lazy decay leaves unvisited edges behind the clock
+            self._pheromone.append(model.state.p)
+
+    def close(self):
+        """
+        Flushes buffered steps and finalizes any output file.
+        """
+        if self.names is not None:
+            self._counts.close()
+            if self.positions:
+                self._positions.close()
+            if self.pheromone:
+                self._pheromone.close()
+
+    def nbytes(self):
+        """
+        Returns the bytes of collected data held in memory (buffers, chunks and preallocated arrays; data already written to a file is not counted).
+        """
+        if self.names is None:
+            return 0
+        return self._counts.nbytes() + (self._positions.nbytes() if self.positions else 0) + (self._pheromone.nbytes() if self.pheromone else 0)
+
+    def occupancy(self):
+        """
+        Returns the (steps x nodes) ant counts (see count_dtype), memory-mapped when collected to .npy.
+        """
+        return self._counts.read()
+
+    def pheromone_history(self):
+        """
+        Returns the (steps x edges) float32 pheromone, edges in G.edges() order (named 'u-v' in self.edges). Needs pheromone=True.
+        """
+        if not self.pheromone:
+            raise ValueError('pheromone was not collected, create the collector with pheromone=True')
+        return self._pheromone.read()
+
+    def position_codes(self):
+        """
+        Returns the (steps x ants) node codes of the positions (indices into self.names). Needs positions=True.
+        """
+        if not self.positions:
+            raise ValueError('positions were not collected, create the collector with positions=True')
+        return self._positions.read()
+
+    def get_occupancy_dataframe(self):
+        """
+        Returns the ant counts as a DataFrame indexed by step with one column per node.
+        """
+        import pandas as pd
+        frame = pd.DataFrame(self.occupancy(), columns=self.names)
+        frame.index.name = 'Step'
+        return frame
+
+    def get_agent_vars_dataframe(self):
+        """
+        Returns the positions in the same (Step, AgentID) -> Position layout as DataCollector.get_agent_vars_dataframe. Needs positions=True.
+        """
+        import pandas as pd
+        codes = np.asarray(self.position_codes())
+        index = pd.MultiIndex.from_product([range(codes.shape[0]), range(codes.shape[1])], names=['Step', 'AgentID'])
+        return pd.DataFrame({'Position': pd.Categorical.from_codes(codes.ravel(), self.names)}, index=index)
+
+
+def count_dtype(ants):
+    """
+    The dtype node counts of a population of ants are stored in: int32 while it fits, int64 for the billions of ants the counts engines run.
+    """
+    if not 0 <= ants <= np.iinfo(np.int64).max:
+        raise ValueError(f'{ants} ants do not fit in an int64 count')
+    return np.int32 if ants <= np.iinfo(np.int32).max else np.int64
+
+def _sibling_path(path, kind):
+    stem, ext = path.rsplit('.', 1)
+    return f'{stem}.{kind}.{ext}'
+
+def _edge_ends(state):
+    """
+    The (u, v) node ids of every undirected edge id of a TreeState.
+    """
+    ends = np.empty((len(state.p), 2), dtype=np.int64)
+    tail = np.repeat(np.arange(len(state.names)), state.degree)
+    ends[state.edge] = np.column_stack((tail, state.indices))
+    return ends
+
+
+class _Store:
+    """
+    Fixed-width rows buffered in chunks and flushed to memory, a preallocated .npy file or a Parquet file.
+    """
+    def __init__(self, width, dtype, steps, path, chunk, columns):
+        self.buffer = np.empty((chunk, width), dtype=dtype)
+        self.filled = 0
+        self.rows = 0
+        self.path = path
+        self.columns = columns
+        self.array = None
+        self.chunks = []
+        self.writer = None
+        if path is None:
+            if steps is not None:
+                self.array = np.empty((steps, width), dtype=dtype)
+        elif path.endswith('.npy'):
+            if steps is None:
+                raise ValueError('collecting to a .npy file needs the number of steps up front')
+            self.array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(steps, width))
+        elif path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self.schema = pa.schema([(name, pa.from_numpy_dtype(self.buffer.dtype)) for name in columns])
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            raise ValueError(f'unsupported collector path {path!r}, expected .npy or .parquet')
+
+    def append(self, row):
+        self.buffer[self.filled] = row
+        self.filled += 1
+        if self.filled == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.filled == 0:
+            return
+        block = self.buffer[:self.filled]
+        if self.writer is not None:
+            import pyarrow as pa
+            self.writer.write_table(pa.Table.from_arrays([block[:, j] for j in range(block.shape[1])], schema=self.schema))
+        elif self.array is not None:
+            if self.rows + self.filled > len(self.array):
+                raise ValueError(f'collected more than the {len(self.array)} preallocated steps')
+            self.array[self.rows:self.rows + self.filled] = block
+        else:
+            self.chunks.append(block.copy())
+        self.rows += self.filled
+        self.filled = 0
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        elif isinstance(self.array, np.memmap):
+            self.array.flush()
+
+    def nbytes(self):
+        held = self.buffer.nbytes + sum(chunk.nbytes for chunk in self.chunks)
+        if self.array is not None and not isinstance(self.array, np.memmap):
+            held += self.array.nbytes
+        return held
+
+    def read(self):
+        if self.path is not None and self.path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            self.close()
+            return pq.read_table(self.path).to_pandas().to_numpy()
+        self.flush()
+        if self.array is not None:
+            return self.array[:self.rows]
+        if not self.chunks:
+            return self.buffer[:0]
+        if len(self.chunks) > 1:
+            self.chunks = [np.concatenate(self.chunks)]
+        return self.chunks[0]
+
+
+class _Loaded:
+    """
+    Rows that were collected before, held as one array.
+    """
+    def __init__(self, array):
+        self.array = array
+
+    def close(self):
+        pass
+
+    def nbytes(self):
+        return self.array.nbytes
+
+    def read(self):
+        return self.array
+
+
+##################################
+#        Occupancy Series        #
+##################################
+
+def occupancy_timeseries(data, nodes=None):
+    """
+    Inputs: data from a model, either the (Step, AgentID) -> Position frame of get_agent_vars_dataframe, an OccupancyCollector, or an occupancy frame (steps x nodes) which is passed through.
+    Optionally nodes, the column order to return; nodes nobody visited get a column of zeros.
+    Output: a DataFrame with the number of ants on every node at every step (the data behind graph_draw's area plot), computed with one bincount over (step, node) codes.
+    Needs only numpy and pandas, so it can be used headless.
+    """
+    import pandas as pd
+    if isinstance(data, OccupancyCollector):
+        frame = data.get_occupancy_dataframe()
+    elif 'Position' not in data:
+        frame = data
+    else:
+        position = data['Position']
+        steps, step_codes = np.unique(position.index.get_level_values('Step'), return_inverse=True)
+        if isinstance(position.dtype, pd.CategoricalDtype):
+            node_codes, names = position.cat.codes.to_numpy(), list(position.cat.categories)
+        else:
+            node_codes, names = pd.factorize(position.to_numpy())
+            names = list(names)
+        counts = np.bincount(step_codes * len(names) + node_codes, minlength=len(steps) * len(names))
+        frame = pd.DataFrame(counts.reshape(len(steps), len(names)), index=pd.Index(steps, name='Step'), columns=names)
+
+    if nodes is not None:
+        frame = frame.reindex(columns=list(nodes), fill_value=0)
+    return frame
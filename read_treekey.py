@@ -1,33 +1,172 @@
+import glob
+import math
+import os
+from collections import namedtuple
+from types import MappingProxyType
+import numpy as np
 import pandas as pd
+from cachefile import write_cache
 
-def read_treekey(file):
+##################################
+#          Parsed Caches         #
+##################################
+# Each csv is parsed once per version: the deduplicated table is saved as a structured .npy next to it, named after the csv's size and
+# modification time (treekey.csv.treekey-<size>-<mtime>.npy), and later loads (in any process) memory-map that file instead of parsing.
+# Editing or replacing the csv changes the name, so a stale table is never read; the old one is removed when the new one is written.
+
+TREEKEY = np.dtype([('junction', np.int64), ('node_from', np.int64), ('width', np.float64)])
+
+
+def _cached(file, kind, parse, cache=True):
+    """
+    Returns parse(file), a structured array, from its cache next to file when there is one for this version of file (memory-mapped), writing it otherwise.
+    Files that cannot be stat'ed (buffers, URLs) and unwritable directories are simply parsed every time.
+    """
+    try:
+        stat = os.stat(file)
+    except (TypeError, OSError):
+        return parse(file)
+    source = os.fspath(file)
+    path = f'{source}.{kind}-{stat.st_size}-{stat.st_mtime_ns}.npy'
+    if cache and os.path.exists(path):
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass # a damaged cache is parsed and written again
+    table = parse(file)
+    if cache and write_cache(path, lambda out: np.save(out, table)):
+        for old in glob.glob(glob.escape(source) + f'.{kind}-*.npy'):
+            if old != path:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+    return table
+
+
+def _strings(column):
+    values = column.astype(str).to_numpy()
+    return values.astype(f'U{max(1, max(map(len, values), default=1))}')
+
+
+##################################
+#            Readers             #
+##################################
+
+def _parse_treekey(file):
+    df = pd.read_csv(file, usecols=['Junction','Width.From','Node.From', 'Turn.Type'])
+    df = df.astype({'Junction' : np.int64, 'Node.From' : np.int64, 'Width.From' : np.float64}).drop_duplicates(['Junction', 'Node.From', 'Width.From'])
+    table = np.empty(len(df), dtype=TREEKEY)
+    table['junction'] = df['Junction'].to_numpy()
+    table['node_from'] = df['Node.From'].to_numpy()
+    table['width'] = df['Width.From'].to_numpy()
+    return table
+
+def treekey_table(file, cache=True):
+    '''
+    The distinct (junction, node_from, width) rows of a treekey csv in file order, as a structured array (cached, see _cached).
+    '''
+    return _cached(file, 'treekey', _parse_treekey, cache)
+
+def read_treekey(file, cache=True):
     '''
     file is a csv containing columns:
 
     Junction, Node.From, Width.From
+
+    Returns the distinct edges as 'junction node_from width' strings, in file order (what nx.read_weighted_edgelist reads).
     '''
-    treekey = []
-    df = pd.read_csv(file, usecols=['Junction','Width.From','Node.From', 'Turn.Type'])
-    for index, row in df.iterrows():
-        edge = f"{int(row[0])} {int(row[2])} {float(row[1])}"
-        if edge not in treekey:
-            treekey.append(edge)
-    return treekey
+    table = treekey_table(file, cache)
+    return [f"{u} {v} {w}" for u, v, w in zip(table['junction'].tolist(), table['node_from'].tolist(), table['width'].tolist())]
 
-def read_predictions(file):
+
+def _parse_predictions(file):
+    df = pd.read_csv(file, usecols=['Junction','Node.From','sharpIsLeft','Sharp.Turn.Prob', 'U.Turn.Prob', 'Turn.Probability'])
+    df = df.drop_duplicates(['Node.From', 'Junction']) # the first prediction of every approach
+    sharp_left = df['sharpIsLeft'].astype(bool).to_numpy()
+    sharp, turn = df['Sharp.Turn.Prob'].to_numpy(dtype=float), df['Turn.Probability'].to_numpy(dtype=float)
+    frm, junction = _strings(df['Node.From']), _strings(df['Junction'])
+    table = np.empty(len(df), dtype=[('from', frm.dtype), ('junction', junction.dtype), ('U', np.float64), ('L', np.float64), ('R', np.float64)])
+    table['from'] = frm
+    table['junction'] = junction
+    table['U'] = df['U.Turn.Prob'].to_numpy(dtype=float)
+    table['L'] = np.where(sharp_left, sharp, turn)
+    table['R'] = np.where(sharp_left, turn, sharp)
+    return table
+
+def predictions_table(file, cache=True):
+    '''
+    The first (from, junction) -> U, L, R prediction of every approach in a predictions csv, as a structured array (cached, see _cached).
+    '''
+    return _cached(file, 'predictions', _parse_predictions, cache)
+
+def read_predictions(file, cache=True):
     '''
     file is a csv containing columns:
 
     Junction, Node.From, sharpIsLeft
+
+    Returns {(from, junction): (U, L, R)} with the sharp and the other turn probability put on the side sharpIsLeft says.
     '''
-    predictions = {}
-    df = pd.read_csv(file, usecols=['Junction','Node.From','sharpIsLeft','Sharp.Turn.Prob', 'U.Turn.Prob', 'Turn.Probability'])
-    for index, row in df.iterrows():
-        approach = (str(row[1]),str(row[0])) # from, to
-        if approach not in predictions.keys():
+    table = predictions_table(file, cache)
+    return dict(zip(zip(table['from'].tolist(), table['junction'].tolist()), zip(table['U'].tolist(), table['L'].tolist(), table['R'].tolist())))
+
+
+def _parse_turn_types(file):
+    df = pd.read_csv(file, usecols=['Node.From', 'Node.To', 'Turn.Type']).drop_duplicates(['Node.From', 'Node.To'])
+    frm, to, kind = _strings(df['Node.From']), _strings(df['Node.To']), _strings(df['Turn.Type'])
+    table = np.empty(len(df), dtype=[('from', frm.dtype), ('to', to.dtype), ('type', kind.dtype)])
+    table['from'] = frm
+    table['to'] = to
+    table['type'] = kind
+    return table
+
+
+Turn = namedtuple('Turn', ['neighbors', 'probs', 'cum'])
+
+def read_turns(treekey_file, predictions_file, cache=True):
+    '''
+    Parses the treekey and predictions csvs once and returns a read-only lookup for the data-driven model:
+
+    (from, junction) -> Turn(neighbors=(U, L, R), probs=(U, L, R), cum=(U, U+L))
+
+    neighbors are the node ids reached by a u-turn, a left and a right turn ('-1' when the junction has no such branch),
+    probs are the read_predictions probabilities with missing branches set to 0 and the rest renormalized,
+    and a uniform draw r picks U if r < cum[0], L if r < cum[1], R otherwise.
+    Node '-1' (the stem below the tree) is left out of the neighbors, like construct_tree removes it.
+    Raises ValueError when the predictions give probability 0 to every branch present at a junction.
+    '''
+    predictions = read_predictions(predictions_file, cache)
+    types = _cached(predictions_file, 'turntypes', _parse_turn_types, cache)
+    turn_type = dict(zip(zip(types['from'].tolist(), types['to'].tolist()), types['type'].tolist()))
+
+    edges = treekey_table(treekey_file, cache)
+    pairs = pd.DataFrame({'u' : edges['junction'], 'v' : edges['node_from']})
+    pairs = pairs[(pairs['u'] != -1) & (pairs['v'] != -1)].drop_duplicates() # one pair per width listed
+    neighbors = {}
+    for u, v in zip(pairs['u'].astype(str).tolist(), pairs['v'].astype(str).tolist()):
+        if v not in neighbors.get(u, []):
+            neighbors.setdefault(u, []).append(v)
+            neighbors.setdefault(v, []).append(u)
 
-            if row[2]: #if sharp is left
-                predictions[approach] = (row[4], row[3], row[5]) #ULR
+    turns = {}
+    for approach, probs in predictions.items():
+        frm, junction = approach
+        if len(neighbors.get(junction, [])) < 2:
+            continue # single way out, no choice to make
+        U = L = R = '-1'
+        for neighbor in neighbors[junction]:
+            if neighbor == frm:
+                U = neighbor
+            elif turn_type.get((frm, neighbor)) == 'L':
+                L = neighbor
             else:
-                predictions[approach] = (row[4], row[5], row[3]) #ULR
-    return predictions
\ No newline at end of file
+                R = neighbor
+        present = [probs[i] if branch != '-1' else 0 for i, branch in enumerate((U, L, R))]
+        total = sum(present)
+        if total <= 0:
+            raise ValueError(f'{predictions_file} gives probability 0 to every branch of junction {junction} approached from {frm}')
+        probs = tuple(prob/total for prob in present)
+        cum = (probs[0], probs[0] + probs[1] if R != '-1' else math.inf)
+        turns[approach] = Turn((U, L, R), probs, cum)
+    return MappingProxyType(turns)
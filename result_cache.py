@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import numpy as np
+from cachefile import write_cache
+from layout import CACHE_DIR
+from occupancy import OccupancyCollector
+from tree_state import TreeState
+
+##################################
+#          Result Cache          #
+##################################
+# sim(..., cache=True) stores what a run produced (the node occupancy, the ant positions when data was asked for, and the final ants and pheromone of the tree)
+# under a hash of everything that decides it: the model module and a hash of its source (the engine version), the full parameters, the tree with its attributes,
+# n, ants, seed and the other sim arguments. A repeat call loads the arrays instead of simulating. Entries are .npz files in one directory; reading one
+# touches it, and writing one evicts the least recently used entries until the directory is back under its size cap.
+
+# Sources whose changes change what a run produces, besides the model module itself
+ENGINE_SOURCES = ('tree_state.py', 'seeding.py')
+
+_versions = {}
+
+
+def engine_version(module):
+    """
+    A hash of the source of a model module and of ENGINE_SOURCES, so editing the models invalidates the results cached before the edit.
+    """
+    if module not in _versions:
+        here = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha1()
+        for name in (module + '.py',) + ENGINE_SOURCES:
+            with open(os.path.join(here, name), 'rb') as file:
+                digest.update(file.read())
+        _versions[module] = digest.hexdigest()
+    return _versions[module]
+
+
+def tree_key(G):
+    """
+    The parts of a tree a run depends on, in G's own node and edge order (which fixes how the random draws are used): node names with 'ntype' and 'nest',
+    and edges with 'weight'. The 'ants' and 'p' a previous run left on G are cleared when a model is built, so they are not part of it.
+    """
+    nodes = [[str(name), d.get('ntype'), bool(d.get('nest', False))] for name, d in G.nodes(data=True)]
+    edges = [[str(u), str(v), float(d.get('weight', 1))] for u, v, d in G.edges(data=True)]
+    return [nodes, edges]
+
+
+def seed_key(seed):
+    """
+    An int or SeedSequence seed as plain data. None and Generators give a different run every time, so their results cannot be cached.
+    """
+    if isinstance(seed, (int, np.integer)):
+        return int(seed)
+    if isinstance(seed, np.random.SeedSequence):
+        return {'entropy' : seed.entropy, 'spawn_key' : list(seed.spawn_key)}
+    raise ValueError(f'caching a run needs a reproducible seed (an int or a SeedSequence), not {seed!r}')
+
+
+class ResultCache:
+    """
+    A directory of cached runs (CACHE_DIR/results by default, set MESANT_CACHE to move it) holding at most max_bytes, least recently used entries evicted first.
+    """
+    def __init__(self, path=None, max_bytes=2**30):
+        self.path = os.path.join(CACHE_DIR, 'results') if path is None else path
+        self.max_bytes = max_bytes
+
+    def key(self, module, G, params, seed, **fields):
+        """
+        The content hash of a run of module on G with the full params dict, seed and the remaining sim arguments in fields.
+        """
+        content = dict(fields, model=module, version=engine_version(module), tree=tree_key(G), params=params, seed=seed_key(seed))
+        return hashlib.sha1(json.dumps(content, sort_keys=True, default=lambda value: value.item()).encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key):
+        """
+        Returns the arrays stored under key (marking the entry as just used), or None.
+        """
+        path = self._file(key)
+        try:
+            with np.load(path) as file:
+                arrays = {name: file[name] for name in file.files}
+            os.utime(path)
+        except (OSError, ValueError):
+            return None # missing, or evicted/damaged under us
+        return arrays
+
+    def put(self, key, **arrays):
+        """
+        Stores arrays under key (atomically, so concurrent runs never read half an entry), then evicts down to max_bytes.
+        """
+        if write_cache(self._file(key), lambda file: np.savez(file, **arrays)):
+            self.evict()
+
+    def entries(self):
+        """
+        (last used, bytes, path) of every entry, least recently used first.
+        """
+        found = []
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return found
+        for name in names:
+            if name.endswith('.npz'):
+                path = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return sorted(found)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+_default = None
+
+def default_cache():
+    """
+    The ResultCache sim(cache=True) uses.
+    """
+    global _default
+    if _default is None:
+        _default = ResultCache()
+    return _default
+
+
+##################################
+#              Runs              #
+##################################
+
+def lookup(cache, module, G, params, seed, **fields):
+    """
+    Inputs: sim's cache argument (True for default_cache() or a ResultCache), the model module name, the tree before the run, the full params, the seed and the other sim arguments.
+    Outputs: the ResultCache, the run's key and the stored arrays (None on a miss).
+    """
+    results = default_cache() if cache is True else cache
+    key = results.key(module, G, params, seed, **fields)
+    return results, key, results.get(key)
+
+def store(cache, key, model, collector):
+    """
+    Saves a finished run: its collected occupancy (and positions when they were collected) and the final ants and p of its tree.
+    """
+    if collector.names is None:
+        return # a collector no model was bound to holds nothing
+    arrays = dict(names=np.array(collector.names), occupancy=collector.occupancy(), ants=model.state.ants, p=model.state.p)
+    if collector.positions:
+        arrays['positions'] = collector.position_codes()
+    cache.put(key, **arrays)
+
+def restore(G, params, arrays):
+    """
+    Puts a cached run's final ants and pheromone onto G (with the 'state' and 'parameters' a run leaves on G.graph) and returns a collector holding its data.
+    """
+    G.graph['parameters'] = params
+    state = TreeState(G)
+    state.ants[:] = arrays['ants']
+    state.p[:] = arrays['p']
+    G.graph['state'] = state
+    state.sync(G)
+    return OccupancyCollector.from_arrays(arrays['names'].tolist(), arrays['occupancy'], arrays.get('positions'))
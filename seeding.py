@@ -0,0 +1,41 @@
+import numpy as np
+
+##################################
+#         Seeded Streams         #
+##################################
+# Every model owns one numpy Generator made with np.random.default_rng(seed), where seed is None (fresh entropy), an int, a SeedSequence or a Generator (used as is).
+
+def spawn(seed, replicates):
+    """
+    Inputs: a root seed (int, SeedSequence or None) and a number of replicates.
+    Output: that many independent child SeedSequences, one per replicate model, e.g. [sim(50, 1000, seed=s) for s in spawn(42, 10)].
+    The same root seed always gives the same children, so a set of replicates can be reproduced or split across workers.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(replicates)
+
+
+class ModelRandom:
+    """
+    ModelRandom stands in for the random.Random that mesa puts on model.random (and agent.random), drawing from the model's numpy Generator instead,
+    so RandomActivation's shuffle and the agents' decisions all come from one seeded stream. random() is served from blocks of draws to keep the per-call cost low.
+    """
+    def __init__(self, rng, block=4096):
+        self.rng = rng
+        self.block = block
+        self._draws = []
+        self._next = 0
+
+    def random(self):
+        if self._next == len(self._draws):
+            self._draws = self.rng.random(self.block).tolist()
+            self._next = 0
+        self._next += 1
+        return self._draws[self._next - 1]
+
+    def shuffle(self, x):
+        self.rng.shuffle(x)
+
+    def choice(self, seq):
+        return seq[int(self.rng.integers(len(seq)))]
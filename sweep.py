@@ -0,0 +1,100 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import importlib
+
+import numpy as np
+
+MODELS = {'individual' : 'MesAntIndividual', 'colony' : 'MesAntColony'}
+
+
+##################################
+#         Parameter Grids        #
+##################################
+
+def parameter_grid(**values):
+    """
+    Inputs: keyword lists of values for entries of parameters, e.g. parameter_grid(left=[1,2], width=[1,2,4]).
+    Output: a list of parameter dicts, one per combination (the cartesian product), ready for run_sweep.
+    """
+    keys = list(values)
+    return [dict(zip(keys, combo)) for combo in itertools.product(*(values[key] for key in keys))]
+
+
+##################################
+#            Summaries           #
+##################################
+
+def summarize(G):
+    """
+    Default per-run summary of a finished tree: ants still at home ('O'), ants in nests, the most occupied nest and its share of the nested ants,
+    plus the total pheromone when the tree carries 'p'. Custom summaries take the same G and return a flat dict; they have to be picklable (module level functions).
+    """
+    state = G.graph['state']
+    nests = np.flatnonzero(state.nest)
+    nested = state.ants[nests]
+    top = nests[np.argmax(nested)] if len(nests) else None
+    stats = {
+        'home' : int(state.ants[state.index['O']]),
+        'nested' : int(nested.sum()),
+        'top_nest' : state.names[top] if top is not None else None,
+        'top_share' : float(nested.max() / nested.sum()) if nested.sum() else 0.0,
+    }
+    if state.has_p:
+        stats['pheromone'] = float(state.p.sum())
+    return stats
+
+
+##################################
+#            Workers             #
+##################################
+# Each worker process imports the model once and keeps one pristine tree, so a task only ships its parameter dict and seed.
+_module = None
+_tree = None
+
+def _init_worker(model, tree):
+    global _module, _tree
+    _module = importlib.import_module(MODELS[model])
+    _tree = _module.default_tree() if tree is None else tree
+
+def _run(task):
+    params, seed, n, ants, engine, summary = task
+    G = _module.sim(n, ants, engine=engine, G=_tree.copy(), params=params, seed=seed)
+    return summary(G)
+
+
+##################################
+#             Sweeps             #
+##################################
+
+def run_sweep(params, seeds=(0,), model='individual', n=50, ants=1000, engine='numpy', tree=None, summary=summarize, workers=None, chunksize=None):
+    """
+    Runs sim() for every parameter dict in params (a list, e.g. from parameter_grid, or a single dict) and every replicate seed in seeds (ints, or SeedSequences from seeding.spawn), across a ProcessPoolExecutor. Runs with the same parameters and seed give the same result.
+    model is 'individual' (MesAntIndividual) or 'colony' (MesAntColony), n, ants and engine are passed to sim, and tree replaces the default tree.
+    Every run gets its own copy of the module-level parameters updated with its dict, so runs never see each other's values.
+    workers=1 runs in this process, which is handy for debugging.
+    Output: a tidy DataFrame with one row per (params, seed) run: the swept parameter columns, seed, then the summary(G) statistics.
+    """
+    if model not in MODELS:
+        raise ValueError(f"unknown model {model!r}, expected one of {list(MODELS)}")
+    if isinstance(params, dict):
+        params = [params]
+    if tree is not None:
+        tree = tree.copy()
+        tree.graph.clear() # drop the state/parameters a previous run may have attached
+    seeds = list(seeds)
+    tasks = [(dict(p), seed, n, ants, engine, summary) for p in params for seed in seeds]
+
+    if workers == 1:
+        _init_worker(model, tree)
+        results = [_run(task) for task in tasks]
+    else:
+        workers = workers or os.cpu_count()
+        if chunksize is None:
+            chunksize = max(1, len(tasks) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model, tree)) as pool:
+            results = list(pool.map(_run, tasks, chunksize=chunksize))
+
+    import pandas as pd
+    rows = [dict(task[0], seed=task[1], **stats) for task, stats in zip(tasks, results)]
+    return pd.DataFrame(rows)
@@ -0,0 +1,30 @@
+import numpy as np
+import MesAntColony
+import MesAntIndividual
+from tree_state import TreeState, leave_chance
+
+##################################
+#          Reused Trees          #
+##################################
+
+def test_reused_tree_runs_like_a_fresh_one():
+    for module, engines in ((MesAntColony, ('mesa', 'numpy')), (MesAntIndividual, ('mesa', 'numpy'))):
+        for engine in engines:
+            fresh = TreeState(module.sim(20, 200, engine=engine, seed=7))
+            G = module.sim(50, 500, engine=engine, seed=1) # leaves its ants and p on G
+            reused = TreeState(module.sim(20, 200, engine=engine, G=G, seed=7))
+            assert np.array_equal(reused.ants, fresh.ants), (module.__name__, engine)
+            assert np.array_equal(reused.p, fresh.p), (module.__name__, engine)
+
+
+##################################
+#          Colony Rules          #
+##################################
+
+def test_leave_chance_falls_from_empty_to_crowded_nests():
+    p0 = 0.1
+    assert np.isclose(leave_chance(0, p0), 1 - (1 - p0) / (1 + np.exp(2)))
+    assert np.isclose(leave_chance(10, p0), (1 + p0) / 2)
+    assert np.isclose(leave_chance(1000, p0), p0)
+    chances = leave_chance(np.arange(100), p0)
+    assert np.all(np.diff(chances) < 0)
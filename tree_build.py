@@ -0,0 +1,71 @@
+import itertools
+import numpy as np
+
+##################################
+#         Default Trees          #
+##################################
+# Leaf widths of the lab's depth 5 tree, from the left most tip and then clock-wise around the tree
+WEIGHTS = (0.338,0.253,0.253,0.253,0.338,0.45,0.253,0.338,0.338,0.45,0.6,0.45,0.338,0.45,0.253,0.338,0.338,0.45,0.253,0.338,0.253,0.338,0.253,0.253,0.45,0.6,0.338,0.45,0.338,0.45,0.338,0.253)
+
+# Tip types of the colony model, in the same clock-wise order
+FOODDIST = ('Food','Food','Nest','Node','Food','Food','Node','Nest','Node','Nest','Food','Food','Food','Food','Nest','Node','Node','Nest','Food','Food','Node','Nest','Food','Food','Nest','Node','Food','Food','Node','Nest','Food','Food')
+
+
+def tile(values, n):
+    """
+    Returns values repeated around the tree to length n (or cut to it), so the default maps extend to any depth.
+    """
+    return [values[i % len(values)] for i in range(n)]
+
+
+##################################
+#       Tree Construction        #
+##################################
+
+def balanced_tree(depth=5, weight_map=None):
+    """
+    Inputs: a 'depth' of the tree and a map of the weights of the leaves (a list or array of 2**depth widths). Weights proceed from left most tip and then clock-wise around the tree.
+    Without a weight_map the lab's widths (WEIGHTS) are repeated around the tree. weight_map is never modified.
+    Output: a dictionary of leaf names with LR nomenclature and corresponding weights
+    """
+    tips = 2**depth
+    if weight_map is None:
+        weight_map = tile(WEIGHTS, tips)
+    weights = np.asarray(weight_map, dtype=float)
+    if weights.shape != (tips,):
+        raise ValueError(f'a depth {depth} tree needs {tips} leaf weights, got {weights.shape}')
+    leaf_names = ('O' + ''.join(tup) for tup in itertools.product('LR', repeat = depth))
+    return dict(zip(leaf_names, weights[::-1].tolist()))
+
+def tree_edges(leaves):
+    """
+    Input: a dictionary of leaf names and branch widths leading to the leaves, named with the convention 'OLRLLRL'.
+    Outputs: the node names in id order (leaves first, then every junction as siblings are joined, level by level up to 'O'), and the (junction, child, width) edges in the order they are added.
+    Sibling leaves are joined into their junction (their name with the last letter cut off) whose width is the wider of the two, the same rule construct_tree has always used.
+    Every node is visited once, so this is linear in the number of leaves.
+    """
+    names = list(leaves)
+    width = dict(leaves)
+    levels = {}
+    for name in names:
+        levels.setdefault(len(name), []).append(name)
+
+    edges = []
+    for length in range(max(levels), 1, -1):
+        pending = set(levels.get(length, []))
+        for leaf in levels.get(length, []):
+            if leaf not in pending:
+                continue
+            leaf2 = leaf[:-1] + ('R' if leaf[-1] == 'L' else 'L')
+            if leaf2 not in pending:
+                raise ValueError(f'{leaf} has no sibling {leaf2}, the leaves do not make up a full binary tree')
+            pending.difference_update((leaf, leaf2))
+            junc = leaf[:-1] # The junction between two nodes is their name with the last letter cut off
+            if junc in width:
+                raise ValueError(f'{junc} is both a leaf and the junction of {leaf} and {leaf2}')
+            names.append(junc)
+            edges.append((junc, leaf2, width[leaf2]))
+            edges.append((junc, leaf, width[leaf]))
+            width[junc] = max(width[leaf], width[leaf2])
+            levels.setdefault(length - 1, []).append(junc)
+    return names, edges
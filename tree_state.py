@@ -0,0 +1,369 @@
+import numpy as np
+import networkx as nx
+
+##################################
+#           Turn Kinds           #
+##################################
+# Every (approach, neighbor) pair is classified once per tree into the multiplier AgAnt.choice would apply to it.
+NONE = 0 # no bias (a parent reached from a child whose name ends in neither L nor R, or a single way out)
+LEFT = 1 # parameters['left']
+RIGHT = 2 # parameters['right']
+UTURN = 3 # parameters['u-turn']
+
+# Node types of the colony model, stored as uint8 codes
+NTYPES = ['Node', 'Nest', 'Food', 'Home']
+
+
+##################################
+#          Tree State            #
+##################################
+
+class TreeState:
+    """
+    TreeState indexes the nodes of a networkx tree with integer ids (in G.nodes() order) and stores its adjacency in CSR form, together with array-backed copies of the
+    node attributes 'ants', 'ntype' and 'nest' and the edge attributes 'weight' and 'p'. Models read and write these arrays in their hot loops (O(1) per access) and only
+    write them back to the graph with sync().
+    Every half-edge u -> v doubles as an 'approach': an ant whose last move was u -> v is fully described by that one integer (pos = v, ppos = u).
+    Approach number (half-edges + v) is the 'starting' approach for an ant sitting on v with no previous node, like a freshly placed AgAnt.
+    """
+    def __init__(self, G):
+        self.names = list(G.nodes())
+        self.index = {name: i for i, name in enumerate(self.names)}
+        nodes = len(self.names)
+
+        # CSR adjacency, keeping the order of G.neighbors() so candidates line up with AgAnt.choice
+        self.degree = np.array([G.degree(name) for name in self.names], dtype=np.int64)
+        self.indptr = np.zeros(nodes + 1, dtype=np.int64)
+        np.cumsum(self.degree, out=self.indptr[1:])
+        self.indices = np.empty(self.indptr[-1], dtype=np.int64)
+        self.edge = np.empty(self.indptr[-1], dtype=np.int64) # undirected edge id of each half-edge, in G.edges() order
+        edge_ids = {}
+        weight = []
+        p = []
+        k = 0
+        for u, name in enumerate(self.names):
+            for neighbor in G.neighbors(name):
+                v = self.index[neighbor]
+                key = (u, v) if u < v else (v, u)
+                if key not in edge_ids:
+                    edge_ids[key] = len(weight)
+                    weight.append(G[name][neighbor].get('weight', 1))
+                    p.append(G[name][neighbor].get('p', 0))
+                self.indices[k] = v
+                self.edge[k] = edge_ids[key]
+                k += 1
+        self.weight = np.array(weight, dtype=float)
+        self.p = np.array(p, dtype=float)
+        self.has_p = len(G.edges()) > 0 and all('p' in d for _, _, d in G.edges(data=True))
+        self.ants = np.array([G.nodes[name].get('ants', 0) for name in self.names], dtype=np.int64)
+        self.ntype = np.array([NTYPES.index(G.nodes[name].get('ntype', 'Node')) for name in self.names], dtype=np.uint8)
+        self.nest = np.array([bool(G.nodes[name].get('nest', False)) for name in self.names]) | (self.ntype == NTYPES.index('Nest'))
+        self._index()
+
+    def _index(self):
+        nodes = len(self.names)
+
+        # Approaches: every half-edge, then one starting approach per node
+        self.approach_node = np.concatenate([self.indices, np.arange(nodes)])
+        self.approach_prev = np.concatenate([np.repeat(np.arange(nodes), self.degree), np.full(nodes, -1)])
+
+        # Candidate moves out of each approach, padded to the largest degree
+        width = max(int(self.degree.max()), 1)
+        deg = self.degree[self.approach_node]
+        self.first = self.indptr[self.approach_node] # half-edge id of candidate 0, so candidate j leads to approach first + j
+        self.valid = np.arange(width) < deg[:, None]
+        self.slot = np.where(self.valid, self.first[:, None] + np.arange(width), 0)
+        self.kinds = self._turn_kinds(deg)
+        self._turns = {}
+
+        # Pheromone decay, see set_decay
+        self.decay_rate = 0.0
+        self.decay_amount = 0.0
+        self.lazy = False
+        self.clock = 0
+        self.settled = np.zeros(len(self.p), dtype=np.int64)
+
+    def subtree(self, keep):
+        """
+        Returns the TreeState of the node ids keep (ascending) and the edges among them, every kept node keeping its remaining neighbors in their original order,
+        so the turn table rows of a node whose neighbors are all kept (a part of the tree inside its halo) are the same as here. Its ants and p are copies.
+        sub.nodes, sub.edge_ids and sub.approach_ids map its node, edge and approach ids back to this state's ids (each in ascending order).
+        """
+        keep = np.asarray(keep, dtype=np.int64)
+        local = np.full(len(self.names), -1, dtype=np.int64)
+        local[keep] = np.arange(len(keep))
+        halves = len(self.indices)
+        tail = self.approach_prev[:halves]
+        half = np.flatnonzero((local[tail] >= 0) & (local[self.indices] >= 0)) # still grouped by tail, in the kept order
+        edges = np.unique(self.edge[half])
+
+        sub = TreeState.__new__(TreeState)
+        sub.names = [self.names[i] for i in keep.tolist()]
+        sub.index = {name: i for i, name in enumerate(sub.names)}
+        sub.degree = np.bincount(local[tail[half]], minlength=len(keep))
+        sub.indptr = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(sub.degree, out=sub.indptr[1:])
+        sub.indices = local[self.indices[half]]
+        sub.edge = np.searchsorted(edges, self.edge[half])
+        sub.weight = self.weight[edges]
+        sub.p = self.p[edges].copy()
+        sub.has_p = self.has_p
+        sub.ants = self.ants[keep].copy()
+        sub.ntype = self.ntype[keep]
+        sub.nest = self.nest[keep]
+        sub.nodes = keep
+        sub.edge_ids = edges
+        sub.approach_ids = np.concatenate([half, halves + keep])
+        sub._index()
+        return sub
+
+    def move(self, node, to):
+        """
+        Moves one ant from node id node to node id to.
+        """
+        self.ants[node] -= 1
+        self.ants[to] += 1
+
+    def set_decay(self, rate=0.0, amount=0.0, lazy=False):
+        """
+        Sets the pheromone decay applied by every decay() call: p = max(p*(1-rate) + amount, 0) on every edge, which covers both the additive pdecay (rate 0, negative amount)
+        and the multiplicative form (a fraction rate, amount 0). With lazy=True decay() only advances a clock; each edge remembers the step it was last brought up to date
+        and the missed steps are applied in closed form when it is next read (settle), so a step costs nothing for the edges no ant visits.
+        """
+        self.settle()
+        self.decay_rate = float(rate)
+        self.decay_amount = float(amount)
+        self.lazy = lazy
+
+    def decay(self):
+        """
+        One time step of pheromone decay, applied to the whole array in one clamped operation (or deferred in lazy mode).
+        """
+        if self.lazy:
+            self.clock += 1
+        else:
+            np.maximum(self.p * (1 - self.decay_rate) + self.decay_amount, 0, out=self.p)
+
+    def settle(self, edges=slice(None)):
+        """
+        Brings the pheromone of the given edge ids up to the current step in lazy mode (a no-op otherwise). Call before reading or adding to p.
+        k missed steps of p = max(a*p + b, 0) give max(a**k * p + b*(1 + a + ... + a**(k-1)), 0): with b <= 0 the unclamped series only falls, so clamping once at the end is exact.
+        """
+        if not self.lazy:
+            return
+        k = self.clock - self.settled[edges]
+        a = 1 - self.decay_rate
+        ak = a ** k
+        total = k if a == 1 else (1 - ak) / (1 - a)
+        self.p[edges] = np.maximum(ak * self.p[edges] + self.decay_amount * total, 0)
+        self.settled[edges] = self.clock
+
+    def clear(self):
+        """
+        Empties the tree of what a previous run left on it (the 'ants' and 'p' sync() wrote back) and restarts the decay clock, so a model built on a reused tree starts like one on a fresh tree.
+        """
+        self.ants[:] = 0
+        self.p[:] = 0
+        self.clock = 0
+        self.settled[:] = 0
+
+    def sync(self, G):
+        """
+        Writes 'ants' (and 'p' when the tree has pheromone) back onto G, which is only needed when the graph itself is read (sim() returning, graph_draw).
+        """
+        self.settle()
+        nx.set_node_attributes(G, dict(zip(self.names, self.ants.tolist())), 'ants')
+        if self.has_p:
+            nx.set_edge_attributes(G, dict(zip(G.edges(), self.p.tolist())), 'p')
+
+    def turns(self, parameters):
+        """
+        Returns the TurnTable for parameters (without pheromone), compiled once per distinct set of turn parameters and reused afterwards.
+        """
+        key = (parameters['left'], parameters['right'], parameters['width'], parameters['u-turn'])
+        if key not in self._turns:
+            self._turns[key] = TurnTable(self, parameters)
+        return self._turns[key]
+
+    def start(self, name):
+        """
+        Returns the starting approach id for an ant placed on node name.
+        """
+        return len(self.indices) + self.index[name]
+
+    def _turn_kinds(self, deg):
+        """
+        Classifies every candidate of every approach using the same LR naming rules as AgAnt.choice:
+        two ways out are biased by the neighbor's last letter, three ways out by u-turn, then left/right relative to the facing direction.
+        """
+        last = np.array([str(name)[-1] for name in self.names])
+        length = np.array([len(str(name)) for name in self.names])
+        prev = self.approach_prev
+        neighbor = self.indices[self.slot]
+        is_l = last[neighbor] == 'L'
+        is_r = last[neighbor] == 'R'
+
+        kinds = np.full(self.slot.shape, NONE, dtype=np.uint8)
+        two = (deg == 2)[:, None]
+        kinds[two & is_l] = LEFT
+        kinds[two & is_r] = RIGHT
+        kinds[two & ~is_l & ~is_r] = UTURN
+
+        three = (deg >= 3)[:, None]
+        uturn = neighbor == prev[:, None]
+        forwards = np.where(prev < 0, True, length[np.maximum(prev, 0)] < length[self.approach_node])[:, None]
+        kinds[three & uturn] = UTURN
+        kinds[three & ~uturn & ((is_l & forwards) | (is_r & ~forwards))] = LEFT
+        kinds[three & ~uturn & ((is_r & forwards) | (is_l & ~forwards))] = RIGHT
+
+        kinds[~self.valid] = NONE
+        return kinds
+
+
+##################################
+#          Turn Tables           #
+##################################
+
+class TurnTable:
+    """
+    TurnTable compiles, for one parameters set, the cumulative U/L/R probabilities of every approach of a TreeState: weight**width (+ p) times the left/right/u-turn bias, normalized.
+    Sampling a move is then a single row lookup plus one uniform draw (sample). With pheromone=True the table follows the TreeState's 'p': a deposit only recompiles
+    the few rows that read that edge (patch), while a change to every edge (decay) recompiles the whole table in one array operation (refresh).
+    With the TreeState in lazy decay mode there is no refresh: rows compiled before the current step are recompiled, with their edges settled, only when they are sampled.
+    """
+    def __init__(self, state, parameters, pheromone=False):
+        self.state = state
+        self.pheromone = pheromone
+        self.edges = state.edge[state.slot]
+        self.base = state.weight[self.edges] ** parameters['width']
+        self.bias = np.array([1, parameters['left'], parameters['right'], parameters['u-turn']], dtype=float)[state.kinds]
+        self.bias[~state.valid] = 0
+        self.last = state.valid.sum(axis=1) - 1
+
+        # Rows reading each edge, grouped by edge id, so patch() can find them
+        rows, cols = np.nonzero(state.valid)
+        edges = self.edges[rows, cols]
+        order = np.argsort(edges, kind='stable')
+        self.edge_rows = rows[order]
+        self.edge_ptr = np.searchsorted(edges[order], np.arange(len(state.weight) + 1))
+
+        self.compiled = np.zeros(len(self.edges), dtype=np.int64) # state.clock each row was compiled at, for lazy decay
+        self.refresh()
+
+    def probabilities(self, rows=slice(None)):
+        """
+        Returns the (rows x max degree) probability of taking each candidate from the given approaches.
+        """
+        probs = self.base[rows]
+        if self.pheromone:
+            self.state.settle(self.edges[rows])
+            probs = probs + self.state.p[self.edges[rows]]
+        probs = probs * self.bias[rows]
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def cumulative(self, p=None, rows=slice(None)):
+        """
+        The compiled table of the given rows for pheromone p (None for none): an edge array gives (rows x max degree), a (batch x edges) stack of them gives
+        one table per batch entry (batch x rows x max degree), so engines running many pheromone vectors at once compile them in one pass.
+        Candidate j is taken when a uniform draw r satisfies cum[j-1] <= r < cum[j], so the choice is (cum <= r).sum().
+        The last candidate and the padding are pushed to infinity so rounding can never select past them.
+        """
+        probs = self.base[rows] if p is None else self.base[rows] + p[..., self.edges[rows]]
+        probs = probs * self.bias[rows]
+        cum = np.cumsum(probs / probs.sum(axis=-1, keepdims=True), axis=-1)
+        last = self.last[rows]
+        cum[..., ~self.state.valid[rows]] = np.inf
+        cum[..., np.arange(len(last)), last] = np.inf
+        return cum
+
+    def _compile(self, rows):
+        if self.pheromone:
+            self.state.settle(self.edges[rows])
+            return self.cumulative(self.state.p, rows)
+        return self.cumulative(None, rows)
+
+    def refresh(self):
+        self.cum = self._compile(slice(None))
+        self.stale = np.zeros(len(self.cum), dtype=bool)
+        self.compiled[:] = self.state.clock
+
+    def _expired(self, approach):
+        """
+        Rows that need recompiling before they are sampled: patched ones, and in lazy decay mode every row compiled before the current step.
+        """
+        if self.pheromone and self.state.lazy:
+            return self.stale[approach] | (self.compiled[approach] != self.state.clock)
+        return self.stale[approach]
+
+    def patch(self, edge):
+        """
+        Marks the rows whose pheromone term changed after edge id edge was updated. They are recompiled the next time they are sampled, so repeated deposits cost one recompile.
+        """
+        self.stale[self.edge_rows[self.edge_ptr[edge]:self.edge_ptr[edge+1]]] = True
+
+    def _recompile(self, approach):
+        """
+        Recompiles a single stale row with plain float arithmetic (cheaper than array calls for at most a handful of candidates).
+        """
+        if self.state.lazy:
+            self.state.settle(self.edges[approach, :self.last[approach] + 1])
+        p = self.state.p
+        probs = [(self.base[approach, j] + p[self.edges[approach, j]]) * self.bias[approach, j] for j in range(self.last[approach] + 1)]
+        total = sum(probs)
+        cum = 0
+        for j in range(len(probs) - 1):
+            cum += probs[j]
+            self.cum[approach, j] = cum / total
+        self.stale[approach] = False
+        self.compiled[approach] = self.state.clock
+
+    def sample(self, approach, r):
+        """
+        Inputs: an approach id (or array of them) and matching uniform draw(s).
+        Outputs: the approach the ant(s) take next; state.approach_node of it is the new position.
+        """
+        if np.ndim(approach) == 0:
+            if self._expired(approach):
+                self._recompile(approach)
+        else:
+            stale = np.unique(approach[self._expired(approach)])
+            if len(stale):
+                self.cum[stale] = self._compile(stale)
+                self.stale[stale] = False
+                self.compiled[stale] = self.state.clock
+        return self.state.first[approach] + (self.cum[approach] <= np.asarray(r)[..., None]).sum(axis=-1)
+
+
+def choose(cum, rows, r):
+    """
+    The candidate each uniform draw r picks from row rows of a compiled table cum (TurnTable.cumulative), i.e. (cum[rows] <= r).sum(),
+    compared column by column (the last one is always infinite), which is cheaper than gathering whole rows.
+    """
+    choice = np.zeros(len(rows), dtype=np.int64)
+    for j in range(cum.shape[-1] - 1):
+        choice += cum[rows, j] <= r
+    return choice
+
+
+##################################
+#          Colony Rules          #
+##################################
+
+def leave_chance(ants, p0):
+    """
+    The chance an ant waiting at a nest that holds ants ants leaves it in a step: logistic in the nest's population, 1-(1-p0)/(1+e**2) for an empty nest (0.89 with p0 = 'leave_home' = 0.1),
+    halfway between 1 and p0 at 10 ants and falling to p0 as the nest fills, so ants settle in crowded nests. ants is a count or an array of counts.
+    """
+    r = 0.2
+    a = 10
+    return -((1-p0)/(1 + np.exp(-r*(ants-a)))) + 1
+
+def arrive_table(state, statuses):
+    """
+    Inputs: a TreeState and the state an ant takes on when it steps onto each node type ({NTYPES entry: state value}).
+    Output: that state for every node id, -1 where the ant keeps its own (plain junctions).
+    """
+    arrive = np.full(len(NTYPES), -1, dtype=np.int16)
+    for ntype, status in statuses.items():
+        arrive[NTYPES.index(ntype)] = status
+    return arrive[state.ntype]